@@ -0,0 +1,273 @@
+"""
+Benchmarks the hot paths of the project on the bundled data sets and saves
+the results as JSON, so runs can be compared for regressions.
+
+Runs offline on the CPU. Benchmarks that need a trained model or extracted
+letters are skipped when those are missing. Solving is benchmarked with the
+NumPy runtime (model.npz) and the Keras model (model.hdf5), or either one.
+
+Usage:
+    python benchmark.py --out results.json
+    python benchmark.py --out numpy.json --engine numpy
+    python benchmark.py --out new.json --compare results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from data import ImageHandler, decodeLetters, isPackedLetters, readPackedLetters, resizeToFit
+from filter import ImageFilter
+from source import openSource
+
+
+PATH_DATA = os.path.join("..", "data")
+PATH_OUT = os.path.join(PATH_DATA, "output")
+
+
+def measure(func, items, warmup=3):
+    """
+    Times a function over every item, then runs it again over every item to
+    measure the peak memory it allocates.
+
+    :param func: Function, called once per item.
+    :param items: List, containing the items to call the function with.
+    :param warmup: Integer, the number of untimed calls made beforehand.
+    :return: Dictionary, the measurements.
+    """
+    for item in items[:warmup]:
+        func(item)
+
+    latencies = np.empty(len(items))
+    timeStart = time.perf_counter()
+    for i, item in enumerate(items):
+        callStart = time.perf_counter()
+        func(item)
+        latencies[i] = time.perf_counter() - callStart
+    elapsed = time.perf_counter() - timeStart
+
+    # Memory is measured in a separate pass as tracing slows down the calls
+    tracemalloc.start()
+    for item in items:
+        func(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(items) else (0, 0, 0)
+    return {
+        "calls": len(items),
+        "p50Ms": p50 * 1000,
+        "p95Ms": p95 * 1000,
+        "p99Ms": p99 * 1000,
+        "itemsPerSecond": len(items) / elapsed if elapsed else 0.0,
+        "peakMemoryBytes": peak,
+    }
+
+
+def cropLetters(images, imageFilter):
+    """
+    :param images: List, containing the captchas.
+    :param imageFilter: ImageFilter, used to detect the letters.
+    :return: List, containing the grayscale letter crops of every captcha.
+    """
+    letters = []
+    for img in images:
+        grayscale = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        for (x0, y0, x1, y1) in imageFilter.computeLetterDetectionAlgorithm(img):
+            letters.append(grayscale[y0:y1, x0:x1])
+    return letters
+
+
+def benchmarkImageHandler(imageHandler, dataset):
+    """
+    :param imageHandler: ImageHandler, rooted at the data directory.
+    :param dataset: String, the name of the data set directory.
+    :return: Dictionary, the measurements of reading and writing.
+    """
+    imageNums = sorted(imageHandler.index(dataset))
+    results = {"read": measure(lambda f: imageHandler.read(f, dataset), imageNums)}
+
+    images = imageHandler.readMany(imageNums, dataset)
+    PATH_TEMP = tempfile.mkdtemp()
+    try:
+        tempHandler = ImageHandler(PATH_TEMP)
+        results["write"] = measure(lambda item: tempHandler.write(item[0], item[1], item[2], "out"), images)
+    finally:
+        shutil.rmtree(PATH_TEMP, ignore_errors=True)
+    return results
+
+
+def benchmarkFilter(images):
+    """
+    :param images: List, containing the captchas.
+    :return: Dictionary, the measurements of letter detection and resizing.
+    """
+    imageFilter = ImageFilter()
+    results = {"computeLetterDetectionAlgorithm": measure(imageFilter.computeLetterDetectionAlgorithm, images)}
+
+    letters = cropLetters(images, imageFilter)
+    results["resizeToFit"] = measure(lambda letter: resizeToFit(letter, 20, 20), letters)
+    return results
+
+
+def benchmarkSolver(images, PATH_MODEL, PATH_LABEL=None):
+    """
+    :param images: List, containing the captchas.
+    :param PATH_MODEL: String, path to the trained model file (Keras .hdf5
+    or NumPy runtime .npz).
+    :param PATH_LABEL: String, path to the labels file (Keras models only).
+    :return: Dictionary, the measurements of solving letters and captchas.
+    """
+    from solver import Solver
+
+    solver = Solver()
+    imageFilter = ImageFilter()
+    model, labeller = solver.loadModel(PATH_MODEL, PATH_LABEL)
+
+    letters = cropLetters(images, imageFilter)
+    return {
+        "solveLetter": measure(lambda letter: solver.solveLetter(letter, model, labeller), letters),
+        "solveCaptcha": measure(lambda img: solver.solveCaptcha(img, model, labeller, imageFilter), images),
+    }
+
+
+def benchmarkLoadData(PATH_LETTERS):
+    """
+    :param PATH_LETTERS: String, path to the extracted letters (or a packed dataset).
+    :return: Dictionary, the measurements of loading the letters.
+    """
+    if isPackedLetters(PATH_LETTERS):
+        # Copying the memory-mapped letters reads all of them from disk
+        def load(_):
+            data, labels = readPackedLetters(PATH_LETTERS)
+            return np.array(data), labels
+    else:
+        source = openSource(PATH_LETTERS)
+        PATH_FILES = sorted(source.path(name) for name in source.glob("*/*.jpg"))
+
+        def load(_):
+            return decodeLetters(PATH_FILES, source=source)
+
+    result = measure(load, [None] * 3, warmup=1)
+    result["letters"] = len(load(None)[1])
+    return result
+
+
+def run(PATH_DATA, PATH_OUT, engine="all"):
+    """
+    Runs every benchmark that the available data allows.
+
+    :param PATH_DATA: String, path to the root data directory.
+    :param PATH_OUT: String, path to the output directory (models and letters).
+    :param engine: String, the model solving captchas: "numpy" (the NumPy
+    runtime), "keras" or "all".
+    :return: Dictionary, the measurements of every benchmark.
+    """
+    imageHandler = ImageHandler(PATH_DATA)
+    results = {}
+
+    models = []
+    if engine in ("numpy", "all"):
+        models.append(("numpy", os.path.join(PATH_OUT, "model.npz"), None))
+    if engine in ("keras", "all"):
+        models.append(("keras", os.path.join(PATH_OUT, "model.hdf5"), os.path.join(PATH_OUT, "labels.dat")))
+
+    for dataset in ("validation", "training"):
+        print(f"Benchmarking '{dataset}' data set...")
+        imageNums = sorted(imageHandler.index(dataset))
+        images = [img for img, _, _ in imageHandler.readMany(imageNums, dataset)]
+        results[dataset] = benchmarkImageHandler(imageHandler, dataset)
+        results[dataset].update(benchmarkFilter(images))
+
+        if dataset == "validation":
+            for name, PATH_MODEL, PATH_LABEL in models:
+                if os.path.isfile(PATH_MODEL) and (PATH_LABEL is None or os.path.isfile(PATH_LABEL)):
+                    print(f"Benchmarking the {name} model...")
+                    results[f"{dataset}.{name}"] = benchmarkSolver(images, PATH_MODEL, PATH_LABEL)
+
+    for name, PATH_LETTERS in (("loadData", os.path.join(PATH_OUT, "letters")),
+                               ("loadPacked", os.path.join(PATH_OUT, "letters_packed"))):
+        if os.path.isdir(PATH_LETTERS):
+            print(f"Benchmarking letter loading from '{PATH_LETTERS}'...")
+            results.setdefault("letters", {})[name] = benchmarkLoadData(PATH_LETTERS)
+
+    return {
+        "metadata": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "maxRssKilobytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        "results": results,
+    }
+
+
+def compare(new, old, tolerance=0.1):
+    """
+    Prints the change in throughput of every benchmark found in both runs.
+
+    :param new: Dictionary, the results of the new run.
+    :param old: Dictionary, the results of the old run.
+    :param tolerance: Float, the fraction of throughput lost that is flagged.
+    :return: List, the names of the benchmarks that regressed.
+    """
+    regressions = []
+    for group, benchmarks in new["results"].items():
+        for name, result in benchmarks.items():
+            previous = old["results"].get(group, {}).get(name)
+            if not previous or not previous["itemsPerSecond"]:
+                continue
+
+            ratio = result["itemsPerSecond"] / previous["itemsPerSecond"]
+            flag = ""
+            if ratio < 1 - tolerance:
+                flag = "  <-- REGRESSION"
+                regressions.append(f"{group}/{name}")
+            print(f"{group}/{name}: {ratio:.2f}x throughput, p95 {previous['p95Ms']:.3f}ms -> {result['p95Ms']:.3f}ms{flag}")
+    return regressions
+
+
+def main():
+    # Keep the benchmarks on the CPU
+    os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+    parser = argparse.ArgumentParser(description="Benchmarks the captcha pipeline.")
+    parser.add_argument("--data", default=PATH_DATA, help="root data directory")
+    parser.add_argument("--output", default=PATH_OUT, help="directory with the model and letters")
+    parser.add_argument("--engine", choices=("numpy", "keras", "all"), default="all",
+                        help="model to solve with: the NumPy runtime (model.npz), Keras (model.hdf5) or both")
+    parser.add_argument("--out", default="benchmark.json", help="file to save the results to")
+    parser.add_argument("--compare", help="results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="throughput loss flagged as regression")
+    args = parser.parse_args()
+
+    results = run(args.data, args.output, args.engine)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=4)
+
+    for group, benchmarks in results["results"].items():
+        for name, result in benchmarks.items():
+            print(f"{group}/{name}: p50 {result['p50Ms']:.3f}ms, p95 {result['p95Ms']:.3f}ms, "
+                  f"p99 {result['p99Ms']:.3f}ms, {result['itemsPerSecond']:.1f}/s, "
+                  f"peak {result['peakMemoryBytes'] / 1024:.0f}KiB")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
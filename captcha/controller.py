@@ -7,7 +7,7 @@ import sys
 from pyqtgraph import QtGui
 
 from data import ImageHandler
-from filter import AnimationPreRenderer
+from filter import AnimationPreRenderer, LiveRenderer
 from gui import ImageDisplay
 
 
@@ -17,14 +17,23 @@ class ImageController:
     algorithms.
     """
 
-    def __init__(self, args, PATH_DATA):
+    def __init__(self, args, PATH_DATA, solver=None, segmentationCache=None):
         """
         :param args: dictionary, containing the control parameters.
         :param PATH_DATA: String, path to the root data directory.
+        :param solver: 3-Tuple, optional (solver, model, labeller) whose
+        predictions are drawn in live mode.
+        :param segmentationCache: SegmentationCache, optional cache consulted
+        before detecting letters in live mode.
         """
         self.fStart = args["fStart"]
         self.fEnd = args["fEnd"]
+        self.workers = args.get("workers", 1)
+        self.isLive = args.get("live", False)
         self.imageHandler = ImageHandler(PATH_DATA)
+        self.liveRenderer = None
+        if self.isLive:
+            self.liveRenderer = LiveRenderer(self.imageHandler, segmentationCache, *(solver or ()))
         self.initializeGUI()
 
     def initializeGUI(self):
@@ -32,7 +41,7 @@ class ImageController:
         Initializes the Qt GUI framework and application.
         """
         self.app = QtGui.QApplication(sys.argv)
-        self.display = ImageDisplay(self.fStart, self.fEnd, self.imageHandler)
+        self.display = ImageDisplay(self.fStart, self.fEnd, self.imageHandler, self.liveRenderer)
 
     def preRenderAllAnimation(self, fDiff):
         """
@@ -41,9 +50,9 @@ class ImageController:
         :param fDiff: The difference range between two consecutive frames.
         """
         preRenderer = AnimationPreRenderer(self.imageHandler)
-        preRenderer.generateOtsuImages(self.fStart, self.fEnd)
-        preRenderer.generateDifferenceImages(self.fStart, self.fEnd, fDiff)
-        preRenderer.generateLetterDetectionImages(self.fStart, self.fEnd)
+        preRenderer.generateOtsuImages(self.fStart, self.fEnd, self.workers)
+        preRenderer.generateDifferenceImages(self.fStart, self.fEnd, fDiff, self.workers)
+        preRenderer.generateLetterDetectionImages(self.fStart, self.fEnd, self.workers)
 
     def runAnimationMode(self, fInterval, fSpeedFactor):
         """
@@ -2,13 +2,26 @@
 Module that is responsible for handling raw data.
 """
 
-import glob
-import pathlib
+import json
 import os
+import pathlib
 import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
-import imutils
+import numpy as np
+
+import instrument
+from source import ArchiveSource, openSource
+
+
+PACKED_LETTERS = "letters.npy"
+PACKED_LABELS = "labels.npy"
+DECODE_CHUNK = 256      # Number of letter images decoded per task of the thread pool
+RESIZERS = {}           # LetterResizer per (width, height), shared by every resizeToFit call
+SPLIT_BLOCK = 100       # Number of consecutive indices that splitIndices splits at a time
 
 
 class ImageHandler:
@@ -21,30 +34,177 @@ class ImageHandler:
         :param PATH_DATA: String, path to the root directory containing data.
         """
         self.PATH_DATA = PATH_DATA
+        self.indices = {}
+        self.sources = {}
+        self.letterCounters = {}
+        self.letterLock = threading.Lock()
+        self.directories = set()
 
-    def read(self, imageNum, PATH_SEARCH_DIR):
+    def read(self, imageNum, PATH_SEARCH_DIR, flags=cv2.IMREAD_COLOR):
         """
         Reads an image in the given directory based on its image number.
 
         The convention is that each image is named as <NUM>_<CAPTCHA>.<ext>.
         For instance, 000395_XL3H.jpg
 
+        The directory may also be an archive (e.g. "dataset/labelled.zip"),
+        whose images are read without extracting it (see source.py).
+
         :param imageNum: Integer, the number of the image.
         :param PATH_SEARCH_DIR: String, path relative to the 'data' directory.
+        :param flags: Integer, the OpenCV imread flags (e.g. cv2.IMREAD_GRAYSCALE).
         :return: 2-Tuple, (imageData, imageName, imageNumberAsString)
         """
+        PATH_IMAGE, label, index = self.lookup(imageNum, PATH_SEARCH_DIR)
+        source = self.sources[os.path.join(self.PATH_DATA, PATH_SEARCH_DIR)]     # Opened by lookup
+        with instrument.span("read"):
+            img = source.readImage(PATH_IMAGE, flags)
+        return img, label, index
+
+    def readMany(self, imageNums, PATH_SEARCH_DIR):
+        """
+        Reads several images in the given directory based on their numbers.
+
+        :param imageNums: Iterable, containing the integer image numbers.
+        :param PATH_SEARCH_DIR: String, path relative to the 'data' directory.
+        :return: List of 3-Tuples, (imageData, imageName, imageNumberAsString)
+        """
+        return [self.read(imageNum, PATH_SEARCH_DIR) for imageNum in imageNums]
+
+    def readFrames(self, imageNums, PATH_SEARCH_DIRS):
+        """
+        Reads the images sharing the same numbers across several directories
+        (e.g. a captcha and the images rendered from it).
+
+        :param imageNums: Iterable, containing the integer image numbers.
+        :param PATH_SEARCH_DIRS: Tuple, paths relative to the 'data' directory.
+        :return: Dictionary, mapping each number found in every directory to
+        a tuple of its images (in the order of the directories).
+        """
+        frames = {}
+        for imageNum in imageNums:
+            try:
+                frames[imageNum] = tuple(self.read(imageNum, PATH_SEARCH_DIR)[0]
+                                         for PATH_SEARCH_DIR in PATH_SEARCH_DIRS)
+            except KeyError:
+                continue
+        return frames
+
+    def lookup(self, imageNum, PATH_SEARCH_DIR):
+        """
+        Finds an image in the given directory based on its image number,
+        without reading it.
+
+        :param imageNum: Integer, the number of the image.
+        :param PATH_SEARCH_DIR: String, path relative to the 'data' directory.
+        :return: 3-Tuple, (imagePath, imageName, imageNumberAsString)
+        """
+        # A miss may be due to a file added within the resolution of the
+        # directory's modification time, so rebuild the index to be sure, but
+        # only once per modification time as most misses are genuine (archives
+        # are only ever replaced as a whole, which changes their mtime)
+        # (a missing directory has no index entry, and nothing to rebuild)
         PATH_SEARCH = os.path.join(self.PATH_DATA, PATH_SEARCH_DIR)
-        SEARCH_STRING = '%06d' % imageNum
-        PATH_IMAGE = glob.glob(f"{PATH_SEARCH}/{SEARCH_STRING}*")
-
-        if PATH_IMAGE:
-            PATH_IMAGE = PATH_IMAGE[0]
-            img = cv2.imread(PATH_IMAGE, 1)
-            fName = pathlib.PurePath(PATH_IMAGE).name.split(".")[0]
-            index, label = fName.split("_")
-            return img, label, index
-        else:
-            raise KeyError(f"Could not find image number '{SEARCH_STRING}' in '{PATH_SEARCH}'")
+        index = self.index(PATH_SEARCH_DIR)
+        cached = self.indices.get(PATH_SEARCH)
+        if (imageNum not in index and cached is not None and not cached[2]
+                and not isinstance(self.sources.get(PATH_SEARCH), ArchiveSource)):
+            index = self.index(PATH_SEARCH_DIR, refresh=True)
+        try:
+            return index[imageNum]
+        except KeyError:
+            raise KeyError(f"Could not find image number '{imageNum:06d}' in '{PATH_SEARCH}'")
+
+    def lookupMany(self, imageNums, PATH_SEARCH_DIR):
+        """
+        Finds several images in the given directory based on their numbers,
+        without reading them.
+
+        :param imageNums: Iterable, containing the integer image numbers.
+        :param PATH_SEARCH_DIR: String, path relative to the 'data' directory.
+        :return: List of 3-Tuples, (imagePath, imageName, imageNumberAsString)
+        """
+        return [self.lookup(imageNum, PATH_SEARCH_DIR) for imageNum in imageNums]
+
+    def count(self, PATH_SEARCH_DIR):
+        """
+        :param PATH_SEARCH_DIR: String, path relative to the 'data' directory.
+        :return: Integer, the number of images in the given directory.
+        """
+        return len(self.index(PATH_SEARCH_DIR))
+
+    def index(self, PATH_SEARCH_DIR, refresh=False):
+        """
+        Returns the index of the images in the given directory, mapping image
+        number to (imagePath, imageName, imageNumberAsString).
+
+        The index is built once per directory and only rebuilt when the
+        modification time of the directory changes (i.e. files were added,
+        removed or renamed), or when refreshed (see lookup).
+
+        Images named after their label only (<CAPTCHA>.<ext>, as in the
+        labelled corpus) are numbered in the order of their names, unless
+        the directory also holds numbered images.
+
+        :param PATH_SEARCH_DIR: String, path relative to the 'data' directory.
+        :param refresh: Boolean, whether to rebuild the index regardless.
+        :return: Dictionary, the index of the directory.
+        """
+        PATH_SEARCH = os.path.join(self.PATH_DATA, PATH_SEARCH_DIR)
+        try:
+            mtime = os.stat(PATH_SEARCH).st_mtime_ns
+        except FileNotFoundError:
+            self.indices.pop(PATH_SEARCH, None)
+            previous = self.sources.pop(PATH_SEARCH, None)
+            if previous is not None:
+                previous.close()
+            return {}
+
+        cached = self.indices.get(PATH_SEARCH)
+        if not refresh and cached is not None and cached[0] == mtime:
+            return cached[1]
+        isRefreshed = refresh and cached is not None and cached[0] == mtime
+
+        # The previous source (e.g. an archive replaced since) is closed
+        source = openSource(PATH_SEARCH)
+        previous = self.sources.get(PATH_SEARCH)
+        self.sources[PATH_SEARCH] = source
+        if previous is not None:
+            previous.close()
+        index = {}
+        unnumbered = []
+        for name in source.names():
+            fName = os.path.basename(name).split(".")[0]
+            if fName.count("_") == 0:
+                unnumbered.append(name)
+            elif fName.count("_") == 1:
+                num, label = fName.split("_")
+                if num.isdigit():
+                    index.setdefault(int(num), (source.path(name), label, num))
+
+        if not index:
+            for num, name in enumerate(sorted(unnumbered), 1):
+                label = os.path.basename(name).split(".")[0]
+                index[num] = (source.path(name), label, f"{num:06d}")
+
+        self.indices[PATH_SEARCH] = (mtime, index, isRefreshed)
+        return index
+
+    def close(self):
+        """
+        Closes the sources of every indexed directory (e.g. open archives).
+        """
+        sources, self.sources = self.sources, {}
+        self.indices = {}
+        for source in sources.values():
+            source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
 
     def write(self, image, imageName, imageNum, PATH_DIR):
         """
@@ -57,9 +217,12 @@ class ImageHandler:
         :param PATH_DIR: String, path to the directory to store letters.
         """
         PATH_DIR = os.path.join(self.PATH_DATA, PATH_DIR)
-        os.makedirs(PATH_DIR, exist_ok=True)
+        if PATH_DIR not in self.directories:
+            os.makedirs(PATH_DIR, exist_ok=True)
+            self.directories.add(PATH_DIR)
         PATH_IMAGE = os.path.join(PATH_DIR, f"{imageNum}_{imageName}.jpg")
-        cv2.imwrite(PATH_IMAGE, image)
+        with instrument.span("write"):
+            cv2.imwrite(PATH_IMAGE, image)
 
     def writeLetter(self, img, label, PATH_DIR):
         """
@@ -69,50 +232,480 @@ class ImageHandler:
         :param img: cv2.Image, containing the letter.
         :param label: String, the label of the letter (e.g. "Z")
         :param PATH_DIR: String, path to the directory to store letters.
+        :return: String, path to the written image.
+        :raises OSError: If the image can't be written (nothing is left behind).
         """
-        # Create dirs as need be
         PATH_DIR = os.path.join(self.PATH_DATA, PATH_DIR, label)
-        os.makedirs(PATH_DIR, exist_ok=True)
+        fPath = self._reserveLetterPath(PATH_DIR)
+        # An empty reserved file would later be read as a corrupt letter
+        try:
+            with instrument.span("write"):
+                isWritten = cv2.imwrite(fPath, img)
+            if not isWritten:
+                raise OSError(f"Could not write letter '{fPath}'")
+        except BaseException:
+            os.remove(fPath)
+            raise
+        return fPath
+
+    def _reserveLetterPath(self, PATH_DIR):
+        """
+        Reserves the next free file path in the given letter directory,
+        i.e. lastFileStored+1.jpg.
 
-        # Check if files exist. If so, save image as lastFileStored+1.jpg
-        fs = glob.glob(f"{PATH_DIR}/*")
-        fPath = os.path.join(PATH_DIR, f"{len(fs)+1}.jpg")
-        cv2.imwrite(fPath, img)
+        The number of the last file stored is kept in memory per directory
+        and only seeded from disk the first time the directory is used. The
+        file is then created exclusively, so concurrent writers (threads or
+        processes) never receive the same path; a writer that loses the race
+        simply moves on to the next number.
+
+        :param PATH_DIR: String, path to the directory of a single label.
+        :return: String, path to the reserved (empty) file.
+        """
+        with self.letterLock:
+            if PATH_DIR not in self.letterCounters:
+                os.makedirs(PATH_DIR, exist_ok=True)
+                self.letterCounters[PATH_DIR] = self._findLastLetterNumber(PATH_DIR)
+
+            while True:
+                self.letterCounters[PATH_DIR] += 1
+                fPath = os.path.join(PATH_DIR, f"{self.letterCounters[PATH_DIR]}.jpg")
+                try:
+                    os.close(os.open(fPath, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    return fPath
+                except FileExistsError:
+                    continue
+
+    def _findLastLetterNumber(self, PATH_DIR):
+        """
+        :param PATH_DIR: String, path to the directory of a single label.
+        :return: Integer, the largest file number stored in the directory.
+        """
+        numbers = [int(stem) for stem, _ in map(os.path.splitext, os.listdir(PATH_DIR))
+                   if stem.isdigit()]
+        return max(numbers, default=0)
 
 
-def resizeToFit(image, width, height):
+class FrameCache:
     """
-    Resize an image to fit within a given size.
+    Responsible for keeping the recently shown frames of the viewer in memory
+    (up to a fixed number, least recently used first out) and for loading the
+    frames about to be shown in a background thread, so changing frames
+    rarely has to wait for the frames to be read (or rendered).
 
-    :param image: image to resize
-    :param width: desired width in pixels
-    :param height: desired height in pixels
-    :return: the resized image
+    The prefetcher follows the direction of travel: it loads the frames ahead
+    of the current one first, then a few behind it in case of a step back.
     """
 
-    # grab the dimensions of the image, then initialize
-    # the padding values
-    (h, w) = image.shape[:2]
+    def __init__(self, loadFrames, capacity=1024, ahead=32, behind=8, chunkSize=8):
+        """
+        :param loadFrames: Function, taking a list of frame numbers and
+        returning a dictionary that maps each existing frame to a tuple of its
+        images (frames that don't exist are left out).
+        :param capacity: Integer, the largest number of frames kept in memory
+        (must be larger than ahead + behind).
+        :param ahead: Integer, the number of frames prefetched in the direction of travel.
+        :param behind: Integer, the number of frames prefetched in the opposite direction.
+        :param chunkSize: Integer, the largest number of frames prefetched at once.
+        """
+        self.loadFrames = loadFrames
+        self.capacity = capacity
+        self.ahead = ahead
+        self.behind = behind
+        self.chunkSize = chunkSize
+
+        self.frames = OrderedDict()
+        self.missing = set()
+        self.position = None
+        self.direction = 1
+        self.isRunning = True
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._prefetch, daemon=True)
+        self.thread.start()
+
+    def get(self, frame):
+        """
+        Returns the images of a frame, from memory if possible, and moves the
+        prefetcher to the frame.
+
+        :param frame: Integer, the number of the frame.
+        :return: Tuple, containing the images of the frame.
+        :raises KeyError: If the frame does not exist.
+        """
+        with self.condition:
+            if self.position is not None and frame != self.position:
+                self.direction = 1 if frame > self.position else -1
+            self.position = frame
+            images = self.frames.get(frame)
+            if images is not None:
+                self.frames.move_to_end(frame)
+            self.condition.notify()
+
+        if images is not None:
+            instrument.count("view.cache.hits")
+            return images
+
+        instrument.count("view.cache.misses")
+        loaded = self._load([frame])
+        if frame not in loaded:
+            raise KeyError(f"Could not find frame '{frame}'")
+        return loaded[frame]
+
+    def close(self):
+        """
+        Stops the prefetcher.
+        """
+        with self.condition:
+            self.isRunning = False
+            self.condition.notify()
+        self.thread.join()
+
+    def _load(self, frames):
+        """
+        Loads frames and keeps them in memory.
+
+        :param frames: List, containing the numbers of the frames.
+        :return: Dictionary, mapping each existing frame to its images.
+        """
+        with instrument.span("view.load"):
+            loaded = self.loadFrames(frames)
+
+        with self.condition:
+            for frame in frames:
+                if frame in loaded:
+                    self.missing.discard(frame)
+                    self.frames[frame] = loaded[frame]
+                    self.frames.move_to_end(frame)
+                else:
+                    # Past the first or last image, so not worth prefetching again
+                    self.missing.add(frame)
+            while len(self.frames) > self.capacity:
+                self.frames.popitem(last=False)
+        return loaded
+
+    def _nextFrames(self):
+        """
+        :return: List, the nearest frames to prefetch (empty if there are none).
+        """
+        if self.position is None:
+            return []
+        frames = [self.position + self.direction*i for i in range(1, self.ahead + 1)]
+        frames += [self.position - self.direction*i for i in range(1, self.behind + 1)]
+        frames = [frame for frame in frames
+                  if frame >= 1 and frame not in self.frames and frame not in self.missing]
+        return frames[:self.chunkSize]
 
-    # if the width is greater than the height then resize along
-    # the width
-    if w > h:
-        image = imutils.resize(image, width=width)
+    def _prefetch(self):
+        """
+        Prefetching thread: loads the nearest frames not in memory, then waits
+        for the position to change once every frame around it is loaded.
+        """
+        while True:
+            with self.condition:
+                frames = self._nextFrames()
+                while self.isRunning and not frames:
+                    self.condition.wait()
+                    frames = self._nextFrames()
+                if not self.isRunning:
+                    return
+
+            instrument.count("view.cache.prefetched", len(self._load(frames)))
+
+
+def isPackedLetters(PATH_PACK):
+    """
+    :param PATH_PACK: String, path to a directory.
+    :return: Boolean, whether the directory contains a packed letter dataset.
+    """
+    return os.path.isfile(os.path.join(PATH_PACK, PACKED_LETTERS))
 
-    # otherwise, the height is greater than the width so resize
-    # along the height
+
+def writePackedLetters(data, labels, PATH_PACK):
+    """
+    Writes letter images as a packed dataset, which is a directory holding a
+    single uint8 array of all letters and an array of their labels (i.e.
+    the label of letter i is found at index i).
+
+    :param data: Numpy Array, (N, 20, 20, 1) letter images in range [0, 255].
+    :param labels: Numpy Array, (N,) the label of each letter (e.g. "Z").
+    :param PATH_PACK: String, path to the directory to store the dataset.
+    """
+    os.makedirs(PATH_PACK, exist_ok=True)
+
+    # Written next to the old files then swapped in, so that readers that
+    # still have the old dataset memory-mapped are unaffected
+    for fName, array in ((PACKED_LABELS, np.asarray(labels, dtype=str)),
+                         (PACKED_LETTERS, np.asarray(data, dtype=np.uint8))):
+        PATH_FILE = os.path.join(PATH_PACK, fName)
+        with open(f"{PATH_FILE}.tmp", "wb") as f:
+            np.save(f, array)
+        os.replace(f"{PATH_FILE}.tmp", PATH_FILE)
+
+
+def appendPackedLetters(data, labels, PATH_PACK):
+    """
+    Appends letter images to a packed dataset (creating it if need be).
+
+    :param data: Numpy Array, (N, 20, 20, 1) letter images in range [0, 255].
+    :param labels: Numpy Array, (N,) the label of each letter (e.g. "Z").
+    :param PATH_PACK: String, path to the directory storing the dataset.
+    """
+    if isPackedLetters(PATH_PACK):
+        oldData, oldLabels = readPackedLetters(PATH_PACK)
+        data = np.concatenate([oldData, np.asarray(data, dtype=np.uint8)])
+        labels = np.concatenate([oldLabels, np.asarray(labels, dtype=str)])
+    writePackedLetters(data, labels, PATH_PACK)
+
+
+def readPackedLetters(PATH_PACK):
+    """
+    Reads a packed letter dataset. The letters are memory-mapped rather than
+    loaded, so only the pages actually used are ever read from disk.
+
+    :param PATH_PACK: String, path to the directory storing the dataset.
+    :return: 2-Tuple, (lettersAsReadOnlyUint8Memmap, labels)
+    """
+    data = np.load(os.path.join(PATH_PACK, PACKED_LETTERS), mmap_mode="r")
+    labels = np.load(os.path.join(PATH_PACK, PACKED_LABELS))
+    return data, labels
+
+
+def decodeLetters(PATH_LETTERS, workers=None, source=None):
+    """
+    Decodes letter images, labelled by the name of their directory.
+
+    The images are decoded straight to grayscale by a pool of threads,
+    each writing into its own rows of a preallocated array, so the
+    result is in the order of the given paths regardless of which
+    thread finishes first.
+
+    :param PATH_LETTERS: List, paths of letter images (stored as <LABEL>/<NUM>.jpg).
+    :param workers: Integer, the number of threads (defaults to the number of processors).
+    :param source: Source, optional directory or archive the paths belong to
+    (see source.openSource), read from the file system otherwise.
+    :return: 2-Tuple, (lettersAsUint8, labels)
+    """
+    workers = workers or os.cpu_count()
+    source = source or openSource(os.curdir)
+    data = np.empty((len(PATH_LETTERS), 20, 20, 1), dtype=np.uint8)  # 3rd channel to make Keras happy
+    labels = np.array([pathlib.PurePath(letter).parent.name for letter in PATH_LETTERS])
+
+    def decode(start):
+        for i in range(start, min(start + DECODE_CHUNK, len(PATH_LETTERS))):
+            img = source.readImage(str(PATH_LETTERS[i]), cv2.IMREAD_GRAYSCALE)
+            resizeToFit(img, 20, 20, out=data[i])
+
+    chunks = range(0, len(PATH_LETTERS), DECODE_CHUNK)
+    if workers == 1 or len(chunks) <= 1:
+        for start in chunks:
+            decode(start)
     else:
-        image = imutils.resize(image, height=height)
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(decode, chunks))
+    return data, labels
+
+
+def packLetters(PATH_SOURCE, PATH_PACK, PATH_LETTERS=None, workers=None):
+    """
+    Packs the letters of a directory tree (or archive) of <LABEL>/<NUM>.jpg
+    letter images (see writePackedLetters), so training can skip decoding them.
+
+    :param PATH_SOURCE: String, path to the directory tree or archive of letter images.
+    :param PATH_PACK: String, path to the directory to store the dataset.
+    :param PATH_LETTERS: List, optional paths of letter images to append to
+    the dataset instead.
+    :param workers: Integer, the number of decoding threads.
+    """
+    if PATH_LETTERS is None:
+        source = openSource(PATH_SOURCE)
+        PATH_LETTERS = sorted(source.path(name) for name in source.glob("*/*.jpg"))
+        data, labels = decodeLetters(PATH_LETTERS, workers, source)
+        writePackedLetters(data, labels, PATH_PACK)
+    else:
+        data, labels = decodeLetters(PATH_LETTERS, workers)
+        appendPackedLetters(data, labels, PATH_PACK)
+
+
+class LetterResizer:
+    """
+    Responsible for resizing images to fit within a fixed size.
+
+    Letter crops only come in a handful of shapes, so the scaling and
+    padding needed for each input shape is planned once and cached. The
+    output is identical to resizing with imutils, padding, then resizing
+    again, but skips the last resize whenever the padding already gives the
+    target size and can write directly into a slot of a batch tensor.
+    """
+
+    def __init__(self, width, height):
+        """
+        :param width: desired width in pixels
+        :param height: desired height in pixels
+        """
+        self.width = width
+        self.height = height
+        self.plans = {}
 
-    # determine the padding values for the width and height to
-    # obtain the target dimensions
-    padW = int((width - image.shape[1]) / 2.0)
-    padH = int((height - image.shape[0]) / 2.0)
+    def resize(self, image, out=None):
+        """
+        Resize an image to fit within the size of the resizer.
 
-    # pad the image then apply one more resizing to handle any
-    # rounding issues
-    image = cv2.copyMakeBorder(image, padH, padH, padW, padW, cv2.BORDER_REPLICATE)
-    image = cv2.resize(image, (width, height))
+        :param image: image to resize
+        :param out: Numpy Array, optional (height, width[, 1]) buffer to write into.
+        :return: the resized image (out if given)
+        """
+        (h, w) = image.shape[:2]
+        plan = self.plans.get((h, w))
+        if plan is None:
+            plan = self.plans[(h, w)] = self._plan(h, w)
+        (dim, padH, padW, isFinalResize) = plan
 
-    return image
+        target = None
+        if out is not None:
+            target = out.reshape((self.height, self.width) + image.shape[2:])
 
+        # shrink/grow along the longest side, interpolating like imutils
+        image = cv2.resize(image, dim, interpolation=cv2.INTER_AREA)
+
+        # pad the image then (only if needed) apply one more resizing to
+        # handle any rounding issues
+        if isFinalResize:
+            image = cv2.copyMakeBorder(image, padH, padH, padW, padW, cv2.BORDER_REPLICATE)
+            image = self._store(cv2.resize(image, (self.width, self.height), dst=target), target)
+        else:
+            image = cv2.copyMakeBorder(image, padH, padH, padW, padW, cv2.BORDER_REPLICATE, dst=target)
+            image = self._store(image, target)
+
+        return image if out is None else out
+
+    @instrument.timed("resize.batch")
+    def resizeBatch(self, images, out=None):
+        """
+        Resize several images to fit within the size of the resizer.
+
+        :param images: List, containing the images to resize.
+        :param out: Numpy Array, optional (N, height, width[, 1]) buffer to write into.
+        :return: Numpy Array, (N, height, width, 1) the resized images (out if given)
+        """
+        if out is None:
+            out = np.empty((len(images), self.height, self.width, 1), dtype=np.uint8)
+
+        for i, image in enumerate(images):
+            self.resize(image, out[i])
+        return out
+
+    def _plan(self, h, w):
+        """
+        Plans how to resize an image of the given shape.
+
+        :param h: Integer, the height of the input image.
+        :param w: Integer, the width of the input image.
+        :return: 4-Tuple, (intermediateSize, padH, padW, isFinalResize)
+        """
+        # if the width is greater than the height then resize along
+        # the width otherwise resize along the height (same as imutils)
+        if w > h:
+            dim = (self.width, int(h * (self.width / float(w))))
+        else:
+            dim = (int(w * (self.height / float(h))), self.height)
+
+        # determine the padding values for the width and height to
+        # obtain the target dimensions
+        padW = int((self.width - dim[0]) / 2.0)
+        padH = int((self.height - dim[1]) / 2.0)
+
+        # resizing to the same size is a plain copy, so it can be skipped
+        isFinalResize = (dim[0] + 2*padW, dim[1] + 2*padH) != (self.width, self.height)
+        return dim, padH, padW, isFinalResize
+
+    def _store(self, image, target):
+        """
+        Makes sure the image ends up in the target buffer, in case OpenCV
+        decided to allocate a new image instead of writing into it.
+
+        :param image: the result of an OpenCV call.
+        :param target: Numpy Array, the buffer it should have been written to.
+        :return: the image
+        """
+        if target is not None and image is not target:
+            target[...] = image.reshape(target.shape)
+        return image
+
+
+def splitIndices(size, testSize=0.25, seed=0):
+    """
+    Splits the indices of a dataset into training and test indices, the same
+    way every time for the same seed.
+
+    Whether an index is for testing only depends on the index itself (and
+    the seed), not on the size of the dataset, so growing a dataset (e.g.
+    appending letters for warm started training) keeps the split of the
+    existing indices and only splits the appended ones. Every block of
+    SPLIT_BLOCK consecutive indices holds exactly its share of test indices.
+
+    :param size: Integer, the number of items in the dataset.
+    :param testSize: Float, the fraction of items used for testing.
+    :param seed: Integer, the seed of the split.
+    :return: 2-Tuple, (trainIndices, testIndices)
+    """
+    numberBlocks = -(-size // SPLIT_BLOCK)
+    keys = hashIndices(np.arange(numberBlocks * SPLIT_BLOCK), seed).reshape(numberBlocks, SPLIT_BLOCK)
+    ranks = np.argsort(np.argsort(keys, axis=1), axis=1)
+    isTest = (ranks < round(SPLIT_BLOCK * testSize)).ravel()[:size]
+    indices = np.arange(size)
+    return indices[~isTest], indices[isTest]
+
+
+def hashIndices(indices, seed=0):
+    """
+    :param indices: Numpy Array, integer indices.
+    :param seed: Integer, the seed of the hash.
+    :return: Numpy Array, a pseudo-random uint64 per index (SplitMix64).
+    """
+    x = indices.astype(np.uint64) + np.uint64(seed * 0x9E3779B97F4A7C15 % 2**64)
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+def readManifest(PATH_MANIFEST):
+    """
+    Reads a manifest, which lists the names of the images already processed.
+
+    :param PATH_MANIFEST: String, path to the manifest file.
+    :return: Set, containing the image names (empty if there is no manifest).
+    """
+    try:
+        with open(PATH_MANIFEST) as f:
+            return set(json.load(f))
+    except FileNotFoundError:
+        return set()
+
+
+def writeManifest(names, PATH_MANIFEST):
+    """
+    :param names: Iterable, containing the image names.
+    :param PATH_MANIFEST: String, path to the manifest file.
+    """
+    os.makedirs(os.path.dirname(PATH_MANIFEST) or ".", exist_ok=True)
+    with open(PATH_MANIFEST, "w") as f:
+        json.dump(sorted(names), f, indent=0)
+
+
+def resizeToFit(image, width, height, out=None):
+    """
+    Resize an image to fit within a given size.
+
+    :param image: image to resize
+    :param width: desired width in pixels
+    :param height: desired height in pixels
+    :param out: Numpy Array, optional (height, width[, 1]) buffer to write into.
+    :return: the resized image
+    """
+    resizer = RESIZERS.get((width, height))
+    if resizer is None:
+        resizer = RESIZERS[(width, height)] = LetterResizer(width, height)
+    return resizer.resize(image, out)
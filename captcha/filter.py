@@ -3,32 +3,186 @@ Module that contains the computer vision algorithms.
 """
 
 
+import hashlib
+import inspect
+import math
+import os
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
 import cv2
-import time
 import numpy as np
 
+import instrument
+from data import ImageHandler, readManifest, writeManifest
+from writer import OutputWriter
+
 
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 GRAY = (127, 127, 127)
 RED = (255, 0, 0)
 
+OTSU_THRESHOLD = 110                    # Threshold of the images shown in the viewer
+
+# Parameters of the letter detection algorithm
+LETTER_THRESHOLD = 127
+CONTOUR_MIN_AREA = 13 * 4               # Letter in captcha = 13 tall * N wide (pixels)
+CONTOUR_MAX_AREA = 13 * 13 * 4          # 2x when letters joined
+SPLIT_RATIOS = ((1.25, 2), (2.25, 3), (3.25, 4))    # (width/height above, number of letters)
+FALLBACK_REGIONS = ((5, 3, 18, 17), (18, 3, 30, 17), (30, 3, 42, 17), (42, 3, 55, 17))
+
+# Identifies the letter detection algorithm in the segmentation cache, along
+# with the code of ImageFilter that detects letters (see segmentationVersion).
+# Bump the revision if the algorithm changes anywhere else (e.g. in OpenCV)
+SEGMENTATION_REVISION = 1
+SEGMENTATION_PARAMETERS = (SEGMENTATION_REVISION, LETTER_THRESHOLD, CONTOUR_MIN_AREA, CONTOUR_MAX_AREA,
+                           SPLIT_RATIOS, FALLBACK_REGIONS)
+SEGMENTATION_CACHE_SIZE = 100000        # Most letter regions kept in the segmentation cache
+SEGMENTATION_CACHE_RECORDS = 64         # Most saves appended to the cache file before it is compacted
+
 
-def printStatus(algorithName):
+class SegmentationCache:
     """
-    Decorator that wraps a function with print statements that indicate
-    process status of the function.
+    Responsible for remembering the letter regions found in images, keyed
+    by the content of the image, so the same images are never segmented
+    twice (even across runs).
+
+    Each save appends the regions added since the previous one to the cache
+    file, tagged with the version of the letter detection algorithm (see
+    segmentationVersion). Regions of other versions are discarded when
+    loading, as are the oldest regions beyond SEGMENTATION_CACHE_SIZE, and
+    the file is then compacted. The cache can be shared between threads
+    (e.g. the viewer and its prefetcher).
+    """
+
+    def __init__(self, PATH_CACHE):
+        """
+        :param PATH_CACHE: String, path to the file storing the cache.
+        """
+        self.PATH_CACHE = PATH_CACHE
+        self.version = segmentationVersion()
+        self.regions = {}
+        self.newRegions = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def key(self, img):
+        """
+        :param img: An image.
+        :return: String, the key of the image based on its content.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((img.shape, img.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(img).data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        :param key: String, the key of an image.
+        :return: List, containing coordinates of individual letters (or None).
+        """
+        return self.regions.get(key)
+
+    def put(self, key, letterRegions):
+        """
+        :param key: String, the key of an image.
+        :param letterRegions: List, containing coordinates of individual letters.
+        """
+        letterRegions = [tuple(region) for region in letterRegions]
+        with self.lock:
+            self.regions[key] = letterRegions
+            self.newRegions[key] = letterRegions
 
-    :param algorithName: String, the name used in the print statements.
-    :return: Function, the wrapped function.
+    def update(self, regions):
+        """
+        :param regions: Dictionary, mapping keys to letter regions.
+        """
+        for key, letterRegions in regions.items():
+            self.put(key, letterRegions)
+
+    def load(self):
+        """
+        Loads the regions of the current version of the letter detection
+        algorithm from disk, and compacts the cache file if it holds anything
+        else (regions of other versions, too many regions or saves, or a
+        save cut short).
+        """
+        records = 0
+        isStale = False
+        regions = {}
+        try:
+            with open(self.PATH_CACHE, "rb") as f:
+                end = 0
+                while True:
+                    try:
+                        version, savedRegions = pickle.load(f)
+                    except EOFError:
+                        isStale = end != os.fstat(f.fileno()).st_size     # Cut short
+                        break
+                    end = f.tell()
+                    records += 1
+                    if version == self.version:
+                        regions.update(savedRegions)
+                    else:
+                        isStale = True
+        except FileNotFoundError:
+            return
+        except (ValueError, TypeError, pickle.UnpicklingError):
+            isStale = True
+
+        if len(regions) > SEGMENTATION_CACHE_SIZE:
+            regions = dict(list(regions.items())[-SEGMENTATION_CACHE_SIZE:])
+            isStale = True
+
+        with self.lock:
+            self.regions.update(regions)
+            if isStale or records > SEGMENTATION_CACHE_RECORDS:
+                self._compact()
+
+    def save(self):
+        """
+        Appends the regions added since the last save to the cache file.
+        """
+        with self.lock:
+            if not self.newRegions:
+                return
+
+            os.makedirs(os.path.dirname(self.PATH_CACHE) or ".", exist_ok=True)
+            record = pickle.dumps((self.version, self.newRegions))
+            with open(self.PATH_CACHE, "ab") as f:
+                f.write(record)
+            self.newRegions = {}
+
+    def _compact(self):
+        """
+        Rewrites the cache file with the regions in memory only, as a single
+        save (must hold the lock).
+        """
+        os.makedirs(os.path.dirname(self.PATH_CACHE) or ".", exist_ok=True)
+        PATH_TEMP = f"{self.PATH_CACHE}.{os.getpid()}.tmp"
+        with open(PATH_TEMP, "wb") as f:
+            pickle.dump((self.version, self.regions), f)
+        os.replace(PATH_TEMP, self.PATH_CACHE)
+        self.newRegions = {}
+
+
+def segmentationVersion():
     """
-    def decorator(func):
-        def wrapper(*args):
-            print(f">>> PRE-RENDERING {str.upper(algorithName)} IMAGES STARTING <<<")
-            func(*args)
-            print(f">>> PRE-RENDERING {str.upper(algorithName)}IMAGES COMPLETE <<<")
-        return wrapper
-    return decorator
+    :return: String, the version of the letter detection algorithm, which
+    changes along with its parameters or the code of ImageFilter that
+    detects letters.
+    """
+    digest = hashlib.sha1(repr(SEGMENTATION_PARAMETERS).encode())
+    for method in (ImageFilter.computeOtsuAlgorithm, ImageFilter._computeLetterDetection,
+                   ImageFilter._computeLetterDetectionBatch, ImageFilter._findLetterRegions):
+        method = inspect.unwrap(method)
+        try:
+            digest.update(inspect.getsource(method).encode())
+        except OSError:
+            digest.update(method.__code__.co_code)     # Source unavailable, the bytecode still changes
+    return digest.hexdigest()
 
 
 class ImageFilter:
@@ -36,13 +190,14 @@ class ImageFilter:
     Responsible for applying filtering algorithms on the images.
     """
 
-    def __init__(self):
+    def __init__(self, segmentationCache=None):
         """
-        A simple constructor that initializes variables used to crudely
-        time algorithms.
+        A simple constructor.
+
+        :param segmentationCache: SegmentationCache, optional cache consulted
+        before detecting letters.
         """
-        self.currentFrame = 0
-        self.timeStart = None
+        self.segmentationCache = segmentationCache
 
     def computeOtsuAlgorithm(self, img, *args):
         """
@@ -73,23 +228,30 @@ class ImageFilter:
         :return: An image resulting from applying the algorithm on the input.
         :return: List, containing coordinates of individual letters.
         """
-        # Utility function to split regions
-        def splitRegion(x, y, w, h, num):
-            regions = []
-            for i in range(1, num+1):
-                fraction = w // num
-                regions.append((x + (i-1)*fraction, y, x + i*fraction, y + h))
-            return regions
-
-        # Letter in captcha = 13 tall * N wide (pixels)
-        contourMinArea = 13 * 4
-        contourMaxArea = 13 * 13 * 4        # 2x when letters joined
+        if self.segmentationCache is not None:
+            key = self.segmentationCache.key(img)
+            letterRegions = self.segmentationCache.get(key)
+            instrument.count("segment.cacheHits", int(letterRegions is not None))
+            if letterRegions is None:
+                letterRegions = self._computeLetterDetection(img)
+                self.segmentationCache.put(key, letterRegions)
+            return list(letterRegions)
+
+        return self._computeLetterDetection(img)
+
+    @instrument.timed("segment")
+    def _computeLetterDetection(self, img):
+        """
+        Runs the letter detection algorithm without consulting the cache.
 
+        :param img: An image.
+        :return: List, containing coordinates of individual letters.
+        """
         # Converts the image to grayscale
         grayscale = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
         # Applies global thresholding to binary
-        args = (grayscale, 127, 255, cv2.THRESH_BINARY)
+        args = (grayscale, LETTER_THRESHOLD, 255, cv2.THRESH_BINARY)
         _, thresh = self.computeOtsuAlgorithm(*args)
 
         # Fill in around the border of the image. This is so that the contour
@@ -101,6 +263,86 @@ class ImageFilter:
         thresh[:, 0] = np.array(20*[255])
         thresh[:, 59] = np.array(20*[255])
 
+        return self._findLetterRegions(thresh)
+
+    def computeLetterDetectionBatch(self, images):
+        """
+        Same as computeLetterDetectionAlgorithm but for a stack of captchas.
+
+        The grayscale conversion, thresholding and border fill are each done
+        once over the whole stack, only the contour detection is per image.
+
+        :param images: Numpy Array, (N, 20, 60, 3) stack of captchas.
+        :return: Numpy Array, (N, 4, 4) the (x0, y0, x1, y1) of each letter.
+        """
+        images = np.ascontiguousarray(images)
+        letterRegions = np.empty((len(images), 4, 4), dtype=np.int32)
+        if self.segmentationCache is None:
+            return self._computeLetterDetectionBatch(images, letterRegions)
+
+        # Only detect letters in the images that are not cached yet
+        keys = [self.segmentationCache.key(img) for img in images]
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self.segmentationCache.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                letterRegions[i] = cached
+        instrument.count("segment.cacheHits", len(images) - len(missing))
+
+        if missing:
+            computed = self._computeLetterDetectionBatch(images[missing], letterRegions[missing])
+            letterRegions[missing] = computed
+            for i, regions in zip(missing, computed.tolist()):
+                self.segmentationCache.put(keys[i], regions)
+        return letterRegions
+
+    @instrument.timed("segment.batch")
+    def _computeLetterDetectionBatch(self, images, letterRegions):
+        """
+        Runs the batch letter detection algorithm without consulting the cache.
+
+        :param images: Numpy Array, (N, 20, 60, 3) stack of captchas.
+        :param letterRegions: Numpy Array, (N, 4, 4) buffer to store the regions.
+        :return: Numpy Array, (N, 4, 4) the (x0, y0, x1, y1) of each letter.
+        """
+        N, H, W = images.shape[:3]
+        if N == 0:
+            return letterRegions
+
+        # Stacking the captchas vertically turns the stack into one tall image
+        grayscale = cv2.cvtColor(images.reshape(N*H, W, 3), cv2.COLOR_BGR2GRAY)
+        args = (grayscale, LETTER_THRESHOLD, 255, cv2.THRESH_BINARY)
+        _, thresh = self.computeOtsuAlgorithm(*args)
+        thresh = thresh.reshape(N, H, W)
+
+        # Fill in around the border of every image (see single image version)
+        thresh[:, 0] = 255
+        thresh[:, H-1] = 255
+        thresh[:, :, 0] = 255
+        thresh[:, :, W-1] = 255
+
+        for i in range(N):
+            letterRegions[i] = self._findLetterRegions(thresh[i])
+        return letterRegions
+
+    def _findLetterRegions(self, thresh):
+        """
+        Finds contours in a thresholded captcha and turns the ones with
+        sufficient area size into exactly four letter regions.
+
+        :param thresh: Numpy Array, the thresholded captcha with a white border.
+        :return: List, containing coordinates of individual letters.
+        """
+        # Utility function to split regions
+        def splitRegion(x, y, w, h, num):
+            regions = []
+            for i in range(1, num+1):
+                fraction = w // num
+                regions.append((x + (i-1)*fraction, y, x + i*fraction, y + h))
+            return regions
+
         # Draws all contours
         contours, _ = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
         # track = cv2.drawContours(img, contours, -1, RED)
@@ -109,19 +351,17 @@ class ImageFilter:
         # rectangle around them
         letterRegions = []
         for c in contours:
-            if contourMaxArea >= cv2.contourArea(c) >= contourMinArea:
+            if CONTOUR_MAX_AREA >= cv2.contourArea(c) >= CONTOUR_MIN_AREA:
                 (x, y, w, h) = cv2.boundingRect(c)
                 # print("Contours Rectangle at: (%d %d) (%d %d)" % (x, y, w, h))
                 # print("Contours Area: %d " % cv2.contourArea(c))
 
                 # Compare the width and height of the contour to detect letters that
                 # are conjoined into one chunk
-                if w / h > 1.25:
-                    letterRegions += splitRegion(x, y, w, h, 2)
-                elif w / h > 2.25:
-                    letterRegions += splitRegion(x, y, w, h, 3)
-                elif w / h > 3.25:
-                    letterRegions += splitRegion(x, y, w, h, 4)
+                for ratio, num in SPLIT_RATIOS:
+                    if w / h > ratio:
+                        letterRegions += splitRegion(x, y, w, h, num)
+                        break
                 else:
                     letterRegions.append((x, y, x+w, y+h))
 
@@ -134,8 +374,7 @@ class ImageFilter:
         # Through trail and error, the numbers below work best for most
         # generated captchas
         elif len(letterRegions) < 4:
-            letterRegions = [(5, 3, 18, 17), (18, 3, 30, 17),
-                             (30, 3, 42, 17), (42, 3, 55, 17)]
+            letterRegions = list(FALLBACK_REGIONS)
 
         # Sort the detected letter images based on the x coordinate to make sure
         # we are processing them from left-to-right so we match the right image
@@ -143,101 +382,325 @@ class ImageFilter:
         letterRegions = sorted(letterRegions)
         return letterRegions
 
-    def _updatePerformanceMeasuring(self):
-        """
-        Updates the last frame called in the animation and prints the time
-        elapsed, and average FPS since the last call to _beginTiming function.
-        """
-        print("--- PERFORMANCE MEASUREMENTS UPDATING ---")
-        self.currentFrame += 1
-        dt = time.time() - self.timeStart
-        fps = (self.currentFrame / dt)
-
-        print("Time Elapsed: %d seconds" % dt)
-        print("Current Frame: %d" % self.currentFrame)
-        print("Overall FPS: %.2f" % fps)
-
-    def _startPerformanceMeasuring(self):
-        """
-        Starts the measuring of time and current frame.
-        To be used in conjunction with it's update method.
-        """
-        print("--- PERFORMANCE MEASUREMENTS STARTING NOW ---")
-        self.timeStart = time.time()
-        self.currentFrame = 0
-
 
 class AnimationPreRenderer:
     """
     Responsible for pre-rendering the output of the image filtering
     algorithms (otherwise real-time rendering is too slow).
+
+    Every generate method accepts a number of workers. With more than one
+    worker, the frames are split into chunks that are rendered by a pool of
+    processes. The output is identical to rendering serially: letters are
+    still written by this process in frame order, so their file numbering
+    does not depend on which worker finishes first.
+
+    The rendered images are written in the background by an OutputWriter
+    (one per worker process, with the same codec and quality), and every
+    generate method returns once they are all written.
     """
 
-    def __init__(self, imageHandler):
+    def __init__(self, imageHandler, segmentationCache=None, outputWriter=None):
         """
         A simple constructor.
 
         :param imageHandler: An instantiated ImageHandler object that is
         responsible for reading and writing to the correct directories.
+        :param segmentationCache: SegmentationCache, optional cache consulted
+        before detecting letters.
+        :param outputWriter: OutputWriter, writes the rendered images (JPEG
+        by default).
         """
         self.imageHandler = imageHandler
-        self.imageFilter = ImageFilter()
+        self.segmentationCache = segmentationCache
+        self.imageFilter = ImageFilter(segmentationCache)
+        self.outputWriter = outputWriter or OutputWriter(imageHandler.PATH_DATA)
 
-    @printStatus("Letter Tracking")
-    def generateLetterDetectionImages(self, fStart, fEnd):
+    @instrument.timed("render.letterDetection")
+    def generateLetterDetectionImages(self, fStart, fEnd, workers=1, PATH_MANIFEST=None):
         """
         :param fStart: The number of first frame.
         :param fEnd: The number of the last frame.
+        :param workers: Integer, the number of processes rendering frames.
+        :param PATH_MANIFEST: String, optional path to a manifest of the
+        captchas whose letters were already extracted. These are skipped,
+        and the newly extracted ones are added to it.
+        :return: List, the paths of the letter images written.
 
         Generates and saves the images that show worm tracking algorithm.
         """
-        for f in range(fStart, fEnd+1):
-            print("Letter tracking rendering progress: %d/%d frames" % (f, fEnd))
+        frames = list(range(fStart, fEnd+1))
+        if PATH_MANIFEST:
+            extracted = readManifest(PATH_MANIFEST)
+            frames = [f for f in frames if self._frameName(f) not in extracted]
+        renderedLetters = self._render("_renderLetterDetectionFrames", frames, workers)
+
+        # Save letters as individual images, in frame order
+        PATH_LETTERS = []
+        for label, letterImages in renderedLetters:
+            for letterLabel, letterImage in zip(label, letterImages):
+                PATH_LETTERS.append(self.imageHandler.writeLetter(letterImage, letterLabel, "output/letters"))
+
+        if PATH_MANIFEST:
+            writeManifest(extracted | {self._frameName(f) for f in frames}, PATH_MANIFEST)
+        return PATH_LETTERS
+
+    @instrument.timed("render.difference")
+    def generateDifferenceImages(self, fStart, fEnd, fDiff, workers=1):
+        """
+        :param fStart: The number of first frame.
+        :param fEnd: The number of the last frame.
+        :param fDiff: The difference range between two consecutive frames.
+        :param workers: Integer, the number of processes rendering frames.
+
+        Generates and saves the images that show the absolute difference
+        between consecutive images.
+        """
+        frames = list(range(fStart, fEnd))
+        self._render("_renderDifferenceFrames", frames, workers, fDiff)
+
+    @instrument.timed("render.otsu")
+    def generateOtsuImages(self, fStart, fEnd, workers=1):
+        """
+        Generates and saves the images that show Otsu's thresholding.
+
+        :param fStart: The number of first f.
+        :param fEnd: The number of the last f.
+        :param workers: Integer, the number of processes rendering frames.
+        """
+        frames = list(range(fStart, fEnd+1))
+        self._render("_renderOtsuFrames", frames, workers)
+
+    def _renderLetterDetectionFrames(self, frames):
+        """
+        Saves the images with letter detection overlays for the given frames.
+
+        :param frames: List, containing the numbers of the frames.
+        :return: List of 2-Tuples, (captchaLabel, letterImages) per frame.
+        """
+        renderedLetters = []
+        for f in frames:
+            instrument.count("render.letterDetection.frames")
             img, label, num = self.imageHandler.read(f, "validation")
             letterRegions = self.imageFilter.computeLetterDetectionAlgorithm(img)
 
-            # First save letters as individual images
-            for i, (x0, y0, x1, y1) in enumerate(letterRegions):
-                letterImage = img[y0:y1, x0:x1]
-                letterLabel = label[i]
-                self.imageHandler.writeLetter(letterImage, letterLabel, "output/letters")
+            # First keep letters as individual images
+            letterImages = [img[y0:y1, x0:x1] for (x0, y0, x1, y1) in letterRegions]
+            renderedLetters.append((label, letterImages))
 
             # Then save entire image with overlays on a black/white image
             grayscale = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            args = (grayscale, 127, 255, cv2.THRESH_BINARY)
+            args = (grayscale, LETTER_THRESHOLD, 255, cv2.THRESH_BINARY)
             _, thresh = self.imageFilter.computeOtsuAlgorithm(*args)
             for i, (x0, y0, x1, y1) in enumerate(letterRegions):
                 overlay = cv2.rectangle(thresh, (x0, y0), (x1, y1), BLACK, 1)
-            self.imageHandler.write(overlay, num, label, "output/detection")
+            self.outputWriter.write(overlay, num, label, "output/detection")
+        return renderedLetters
 
-    @printStatus("Difference")
-    def generateDifferenceImages(self, fStart, fEnd, fDiff):
+    def _renderDifferenceFrames(self, frames, fDiff):
         """
-        :param fStart: The number of first frame.
-        :param fEnd: The number of the last frame.
-        :param fDiff: The difference range between two consecutive frames.
+        Saves the difference images for the given frames.
 
-        Generates and saves the images that show the absolute difference
-        between consecutive images.
+        :param frames: List, containing the numbers of the frames.
+        :param fDiff: The difference range between two consecutive frames.
+        :return: List, empty (nothing to save in order).
         """
-        for f in range(fStart, fEnd):
-            print("Difference rendering progress: %d/%d frames" % (f, fEnd))
+        for f in frames:
+            instrument.count("render.difference.frames")
             img1, num, label = self.imageHandler.read(f, "validation")
             img2, _, _ = self.imageHandler.read(f + fDiff, "validation")
             diff = self.imageFilter.computeDifferenceAlgorithm(img1, img2)
-            self.imageHandler.write(diff, num, label, "output/difference")
+            self.outputWriter.write(diff, num, label, "output/difference")
+        return []
 
-    @printStatus("Otsu")
-    def generateOtsuImages(self, fStart, fEnd):
+    def _renderOtsuFrames(self, frames):
         """
-        Generates and saves the images that show Otsu's thresholding.
+        Saves the Otsu's thresholding images for the given frames.
 
-        :param fStart: The number of first f.
-        :param fEnd: The number of the last f.
+        :param frames: List, containing the numbers of the frames.
+        :return: List, empty (nothing to save in order).
         """
-        for f in range(fStart, fEnd+1):
-            print("Otsu rendering progress: %d/%d frames" % (f, fEnd))
+        for f in frames:
+            instrument.count("render.otsu.frames")
             img, num, label = self.imageHandler.read(f, "validation")
-            args = (img, 110, 255, cv2.THRESH_BINARY)
+            args = (img, OTSU_THRESHOLD, 255, cv2.THRESH_BINARY)
             _, thresh = self.imageFilter.computeOtsuAlgorithm(*args)
-            self.imageHandler.write(thresh, num, label, "output/otsu")
+            self.outputWriter.write(thresh, num, label, "output/otsu")
+        return []
+
+    def _frameName(self, f):
+        """
+        :param f: The number of the frame.
+        :return: String, the name of the frame's image (e.g. 000395_XL3H).
+        """
+        PATH_IMAGE, _, _ = self.imageHandler.lookup(f, "validation")
+        return os.path.splitext(os.path.basename(PATH_IMAGE))[0]
+
+    def _render(self, method, frames, workers, *args):
+        """
+        Runs a render method over the frames, either directly or split into
+        chunks over a pool of processes.
+
+        :param method: String, the name of the render method to run.
+        :param frames: List, containing the numbers of the frames.
+        :param workers: Integer, the number of processes rendering frames.
+        :param args: The remaining arguments of the render method.
+        :return: List, the concatenated results of the render method in frame order.
+        """
+        if workers <= 1 or len(frames) <= 1:
+            results = getattr(self, method)(frames, *args)
+            self.outputWriter.flush()
+            return results
+
+        # Workers load the segmentation cache from disk (once each) and send
+        # back whatever they added to it
+        PATH_CACHE = None
+        if self.segmentationCache is not None:
+            self.segmentationCache.save()
+            PATH_CACHE = self.segmentationCache.PATH_CACHE
+
+        # A few chunks per worker keeps the workers busy till the end
+        chunkSize = math.ceil(len(frames) / (4*workers))
+        tasks = [(method, frames[i:i+chunkSize], args) for i in range(0, len(frames), chunkSize)]
+        # Workers record their instrumentation events and send them back too
+        output = (self.outputWriter.codec, self.outputWriter.quality)
+        initArgs = (self.imageHandler.PATH_DATA, PATH_CACHE, output, instrument.sink.enabled)
+
+        results = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initRenderWorker, initargs=initArgs) as executor:
+            for chunkResults, newRegions, events in executor.map(_renderChunk, tasks):
+                results += chunkResults
+                if self.segmentationCache is not None:
+                    self.segmentationCache.update(newRegions)
+                instrument.replay(events)
+        return results
+
+
+# The pre-renderer of a worker process of AnimationPreRenderer, reused across chunks
+_workerPreRenderer = None
+
+
+def _initRenderWorker(PATH_DATA, PATH_CACHE, output, isInstrumented):
+    """
+    Sets up a worker process of AnimationPreRenderer: its image handler,
+    segmentation cache, output writer and instrumentation are built once
+    and reused by every chunk it renders.
+
+    :param PATH_DATA: String, path to the root data directory.
+    :param PATH_CACHE: String, path to the segmentation cache (None for no cache).
+    :param output: 2-Tuple, (codec, quality) of the rendered images.
+    :param isInstrumented: Boolean, whether to record instrumentation events.
+    """
+    global _workerPreRenderer
+    instrument.configure(instrument.BufferSink() if isInstrumented else instrument.NullSink())
+    segmentationCache = SegmentationCache(PATH_CACHE) if PATH_CACHE else None
+    codec, quality = output
+    _workerPreRenderer = AnimationPreRenderer(ImageHandler(PATH_DATA), segmentationCache,
+                                              OutputWriter(PATH_DATA, codec, quality))
+
+
+def _renderChunk(task):
+    """
+    Renders a chunk of frames in a worker process of AnimationPreRenderer
+    (see _initRenderWorker).
+
+    :param task: 3-Tuple, (methodName, frames, args)
+    :return: 3-Tuple, (resultsOfRenderMethod, newSegmentationCacheEntries, instrumentationEvents)
+    """
+    method, frames, args = task
+    preRenderer = _workerPreRenderer
+    results = getattr(preRenderer, method)(frames, *args)
+    preRenderer.outputWriter.flush()
+
+    # Only send back what this chunk added
+    newRegions = {}
+    segmentationCache = preRenderer.segmentationCache
+    if segmentationCache is not None:
+        with segmentationCache.lock:
+            newRegions, segmentationCache.newRegions = segmentationCache.newRegions, {}
+    events = instrument.sink.drain() if instrument.sink.enabled else []
+    return results, newRegions, events
+
+
+class LiveRenderer:
+    """
+    Responsible for rendering the images shown in the viewer on demand,
+    straight from the captchas, instead of reading images pre-rendered by
+    AnimationPreRenderer (which skips the pre-render pass and the lossy
+    JPEG round trip).
+
+    Frames are rendered a chunk at a time, so thresholding and letter
+    detection run once over the whole stack of captchas. The rendered
+    frames are memoized by the viewer's FrameCache and the letter regions
+    by the segmentation cache.
+
+    Frames are requested by both the GUI thread (on a cache miss) and the
+    prefetcher, so rendering takes turns: Keras models are not meant to be
+    shared between threads.
+    """
+
+    def __init__(self, imageHandler, segmentationCache=None, solver=None, model=None, labeller=None):
+        """
+        :param imageHandler: ImageHandler, used to read the captchas.
+        :param segmentationCache: SegmentationCache, optional cache consulted
+        before detecting letters.
+        :param solver: Solver, optional solver whose predictions are drawn
+        (otherwise only the detected letters are drawn).
+        :param model: The neural network model of the solver.
+        :param labeller: The labels of the solver.
+        """
+        self.imageHandler = imageHandler
+        self.imageFilter = ImageFilter(segmentationCache)
+        self.solver = solver
+        self.model = model
+        self.labeller = labeller
+        self.lock = threading.Lock()
+
+    def renderFrames(self, frames):
+        """
+        :param frames: List, containing the numbers of the frames.
+        :return: Dictionary, mapping each existing frame to a 3-tuple of
+        images, (captcha, solvedOrDetectionOverlay, otsu).
+        """
+        with self.lock:
+            return self._renderFrames(frames)
+
+    @instrument.timed("render.live")
+    def _renderFrames(self, frames):
+        """
+        Same as renderFrames, but must only run on one thread at a time.
+        """
+        captchas = self.imageHandler.readFrames(frames, ("validation",))
+        if not captchas:
+            return {}
+        found = list(captchas)
+        images = np.stack([captchas[f][0] for f in found])
+        instrument.count("render.live.frames", len(found))
+
+        # Thresholding is per pixel, so the stack is thresholded as one tall image
+        N, height, width, channels = images.shape
+        _, otsu = self.imageFilter.computeOtsuAlgorithm(images.reshape(N*height, width, channels),
+                                                        OTSU_THRESHOLD, 255, cv2.THRESH_BINARY)
+        otsu = otsu.reshape(images.shape)
+
+        if self.solver is not None:
+            solved = self.solver.solveBatch(list(images), self.model, self.labeller, self.imageFilter)
+            overlays = [outImage for _, outImage in solved]
+        else:
+            overlays = self._renderDetection(images)
+        return {f: (img, overlay, thresh) for f, img, overlay, thresh in zip(found, images, overlays, otsu)}
+
+    def _renderDetection(self, images):
+        """
+        :param images: Numpy Array, (N, 20, 60, 3) stack of captchas.
+        :return: Numpy Array, (N, 20, 60, 3) the thresholded captchas with
+        the detected letters drawn on them.
+        """
+        N, height, width, channels = images.shape
+        grayscale = cv2.cvtColor(images.reshape(N*height, width, channels), cv2.COLOR_BGR2GRAY)
+        _, thresh = self.imageFilter.computeOtsuAlgorithm(grayscale, LETTER_THRESHOLD, 255, cv2.THRESH_BINARY)
+        overlays = cv2.cvtColor(thresh, cv2.COLOR_GRAY2BGR).reshape(images.shape)
+
+        for overlay, regions in zip(overlays, self.imageFilter.computeLetterDetectionBatch(images).tolist()):
+            for (x0, y0, x1, y1) in regions:
+                cv2.rectangle(overlay, (x0, y0), (x1, y1), BLACK, 1)
+        return overlays
@@ -5,8 +5,8 @@ import numpy as np
 import pyqtgraph as pg
 from pyqtgraph import QtCore, QtGui, dockarea
 
-import pyqtgraph.examples
-# pyqtgraph.examples.run()
+import instrument
+from data import FrameCache
 
 
 class ImageDisplay(QtGui.QWidget):
@@ -14,12 +14,14 @@ class ImageDisplay(QtGui.QWidget):
     Responsible for rendering the images on screen using qt/pyqtgraph.
     """
 
-    def __init__(self, fStart, fEnd, imageHandler):
+    def __init__(self, fStart, fEnd, imageHandler, liveRenderer=None):
         """
         :param fStart: The number of first frame of the animation.
         :param fEnd: The number of the last frame of the animation.
         :param imageHandler: An instantiated ImageHandler object that is
         responsible for reading and writing to the correct directories.
+        :param liveRenderer: LiveRenderer, optionally renders the images on
+        demand (otherwise the pre-rendered images are read).
         """
         # Initialize super class and instance variables
         super(self.__class__, self).__init__()
@@ -27,6 +29,11 @@ class ImageDisplay(QtGui.QWidget):
         self.fStart = fStart
         self.fEnd = fEnd
         self.frame = 1
+        if liveRenderer is not None:
+            self.frameCache = FrameCache(liveRenderer.renderFrames)
+        else:
+            self.frameCache = FrameCache(
+                lambda frames: imageHandler.readFrames(frames, ("validation", "output/solved", "output/otsu")))
 
         # Initializing window and docks
         self.initializeWindow()
@@ -100,8 +107,6 @@ class ImageDisplay(QtGui.QWidget):
         being displayed.
         """
         self.frame = self.animationTimer.currentFrame()
-        time = self.animationTimer.currentTime()
-        print("Frame: %d, Time: %.3f seconds" % (self.frame, time/1000.0))
         self.updateImages()
 
     def runAnimation(self, fInterval, fSpeedFactor):
@@ -146,13 +151,10 @@ class ImageDisplay(QtGui.QWidget):
             "axes": {'x': 1, 'y': 0, 'c': 2}    # Flip image
         }
 
-        raw, _, _ = self.imageHandler.read(self.frame, "validation")
+        instrument.count("view.updates")
+        raw, solved, otsu = self.frameCache.get(self.frame)
         self.topImageView.setImage(raw, **kwargs)
-
-        solved, _, _ = self.imageHandler.read(self.frame, "output/solved")
         self.rightImageView.setImage(solved, **kwargs)
-
-        otsu, _, _ = self.imageHandler.read(self.frame, "output/otsu")
         self.leftImageView.setImage(otsu, **kwargs)
 
     def _generateView(self):
@@ -0,0 +1,253 @@
+"""
+Module that contains the instrumentation of the hot paths (reading,
+segmenting, resizing, predicting and writing images).
+
+Instrumentation is off by default, in which case a span or counter costs a
+single attribute check. It is turned on by configuring a sink, either in
+code or through the CAPTCHA_INSTRUMENTATION environment variable:
+
+    CAPTCHA_INSTRUMENTATION=aggregate               (summary kept in memory)
+    CAPTCHA_INSTRUMENTATION=jsonl:events.jsonl      (one JSON line per event)
+
+Worker processes don't share the sink of the main process: they record
+their events in a BufferSink and send them back to be replayed into it.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+
+
+class NullSink:
+    """
+    Responsible for discarding every event (instrumentation off).
+    """
+    enabled = False
+
+    def record(self, kind, name, value):
+        pass
+
+    def close(self):
+        pass
+
+
+class AggregateSink:
+    """
+    Responsible for summarising events in memory: the number, total and
+    maximum of the durations of each span, and the total of each counter.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.spans = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def record(self, kind, name, value):
+        """
+        :param kind: String, either "span" or "count".
+        :param name: String, the name of the span or counter.
+        :param value: Number, seconds for a span, increment for a counter.
+        """
+        with self.lock:
+            if kind == "span":
+                calls, total, longest = self.spans.get(name, (0, 0.0, 0.0))
+                self.spans[name] = (calls + 1, total + value, max(longest, value))
+            else:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """
+        :return: Dictionary, the summary of the spans and counters.
+        """
+        with self.lock:
+            spans = {name: {"calls": calls, "totalSeconds": total, "meanSeconds": total / calls,
+                            "maxSeconds": longest}
+                     for name, (calls, total, longest) in self.spans.items()}
+            return {"spans": spans, "counters": dict(self.counters)}
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    """
+    Responsible for writing every event as a line of JSON to a file.
+    """
+    enabled = True
+
+    def __init__(self, PATH_FILE):
+        """
+        :param PATH_FILE: String, path to the file to append the events to.
+        """
+        self.file = open(PATH_FILE, "a", buffering=1024*1024)
+        self.lock = threading.Lock()
+
+    def record(self, kind, name, value):
+        """
+        :param kind: String, either "span" or "count".
+        :param name: String, the name of the span or counter.
+        :param value: Number, seconds for a span, increment for a counter.
+        """
+        line = json.dumps({"time": time.time(), "kind": kind, "name": name, "value": value})
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class BufferSink:
+    """
+    Responsible for keeping every event in memory, e.g. in a worker process
+    until the events are sent back to the main process (see replay).
+    """
+    enabled = True
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def record(self, kind, name, value):
+        """
+        :param kind: String, either "span" or "count".
+        :param name: String, the name of the span or counter.
+        :param value: Number, seconds for a span, increment for a counter.
+        """
+        with self.lock:
+            self.events.append((kind, name, value))
+
+    def drain(self):
+        """
+        :return: List of 3-Tuples, (kind, name, value) the events recorded
+        since the last drain (which are no longer kept).
+        """
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+    def close(self):
+        pass
+
+
+class Span:
+    """
+    Responsible for timing a block of code (used as a context manager).
+    """
+    __slots__ = ("sink", "name", "timeStart")
+
+    def __init__(self, sink, name):
+        self.sink = sink
+        self.name = name
+
+    def __enter__(self):
+        self.timeStart = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.sink.record("span", self.name, time.perf_counter() - self.timeStart)
+        return False
+
+
+class NullSpan:
+    """
+    Responsible for timing nothing (instrumentation off).
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+sink = NullSink()
+
+
+def configure(newSink):
+    """
+    Replaces the sink that receives every event.
+
+    :param newSink: The new sink (NullSink turns instrumentation off).
+    :return: The previous sink (which is not closed).
+    """
+    global sink
+    previous, sink = sink, newSink
+    return previous
+
+
+def configureFromEnvironment():
+    """
+    Configures the sink from the CAPTCHA_INSTRUMENTATION environment variable.
+
+    :return: The configured sink.
+    """
+    spec = os.environ.get("CAPTCHA_INSTRUMENTATION", "")
+    if spec == "aggregate":
+        configure(AggregateSink())
+    elif spec.startswith("jsonl:"):
+        configure(JsonLinesSink(spec[len("jsonl:"):]))
+    elif spec:
+        raise ValueError(f"Unknown instrumentation '{spec}'")
+    return sink
+
+
+def replay(events):
+    """
+    Records the events of another sink (e.g. a BufferSink of a worker
+    process) in the current sink.
+
+    :param events: List of 3-Tuples, (kind, name, value)
+    """
+    if sink.enabled:
+        for kind, name, value in events:
+            sink.record(kind, name, value)
+
+
+def span(name):
+    """
+    Times a block of code:
+
+        with instrument.span("segment"):
+            ...
+
+    :param name: String, the name of the span.
+    :return: A context manager.
+    """
+    if not sink.enabled:
+        return NULL_SPAN
+    return Span(sink, name)
+
+
+def count(name, n=1):
+    """
+    Increments a counter.
+
+    :param name: String, the name of the counter.
+    :param n: Number, the increment.
+    """
+    if sink.enabled:
+        sink.record("count", name, n)
+
+
+def timed(name):
+    """
+    Decorator that times every call of a function as a span.
+
+    :param name: String, the name of the span.
+    :return: Function, the wrapped function.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not sink.enabled:
+                return func(*args, **kwargs)
+            with Span(sink, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,65 +1,385 @@
 """
 Main script for analysing captcha images and running a neural network on them.
+
+Without a command, runs every step (extract, render, train, solve, view).
+Each step can also be run on its own, importing only what it needs (e.g.
+solving never loads the Qt GUI, and with the NumPy runtime not even Keras):
+
+    python main.py extract      Extracts the letters of the captchas
+    python main.py train        Trains the neural network on the letters
+    python main.py solve        Solves the validation captchas
+    python main.py render       Pre-renders the images shown in the viewer
+    python main.py view         Shows the captchas in the viewer
 """
 
 __date__ = "2019-05-26"
 __author__ = "Othman Alikhan"
 
+import argparse
+import json
 import os
+import pickle
 import shutil
 
-from controller import ImageController
-from data import ImageHandler
-from filter import AnimationPreRenderer
-from neural import NeuralNetwork
-from solver import Solver
+import instrument
 
 
-def main():
-    pRender = \
-        {
-            "fStart":       1,    # First image in validation dataset to render
-            "fEnd":         200,  # Last image in validation dataset to render
-            "fInterval":    500,  # milliseconds
-            "fDiff":        1,
-            "fSpeedFactor": 1,
-        }
-
-    PATH_DATA = os.path.join("..", "data")
-    PATH_OUT = os.path.join(PATH_DATA, "output")
-
-    PATH_TRAINING = os.path.join(PATH_OUT, "letters")
-    PATH_VALIDATION = os.path.join(PATH_DATA, "validation")
-
-    PATH_MODEL = os.path.join(PATH_OUT, "model.hdf5")
-    PATH_LABEL = os.path.join(PATH_OUT, "labels.dat")
-
-    # Cleanup old results
-    shutil.rmtree(PATH_OUT, ignore_errors=True)
+pRender = \
+    {
+        "fStart":       1,    # First image in validation dataset to render
+        "fEnd":         200,  # Last image in validation dataset to render
+        "fInterval":    500,  # milliseconds
+        "fDiff":        1,
+        "fSpeedFactor": 1,
+        "workers":      os.cpu_count(),   # Processes used to pre-render
+        "live":         False,            # Render the viewer's images on demand instead of pre-rendering them
+    }
+
+pTrain = \
+    {
+        "incremental":       False,  # Only extract new captchas and continue training the saved model
+        "epochs":            5,      # Epochs when training from scratch
+        "epochsIncremental": 1,      # Epochs when continuing to train the saved model
+        "streaming":         False,  # Read letters from disk per batch (for datasets larger than memory)
+        "quantize":          False,  # Also export an int8 model and report its accuracy against the float one
+        "engine":            "letters",  # "letters" (detect letters then classify each) or "captcha" (whole captcha)
+        "epochsCaptcha":     20,     # Epochs when training the whole captcha model
+        "dataset":           "training",  # Captchas the whole captcha model trains on (directory or zip/tar archive)
+        "cascade":           False,  # Answer the letters that closely match a prototype before the neural network
+    }
+
+pOutput = \
+    {
+        "codec":   "jpg",    # Format of solved and rendered images: "jpg", "png", "raw" (.npy) or "none"
+        "quality": None,     # JPEG quality (0-100) or PNG compression (0-9), None for the codec's default
+        "views":   "link",   # How solved captchas appear among the (in)correct ones: "link" or "index" (file)
+    }
+
+PATH_DATA = os.path.join("..", "data")
+PATH_OUT = os.path.join(PATH_DATA, "output")
+
+PATH_TRAINING = os.path.join(PATH_OUT, "letters")
+PATH_PACKED = os.path.join(PATH_OUT, "letters_packed")
+PATH_DETECTION = os.path.join(PATH_OUT, "detection")
+PATH_VALIDATION = os.path.join(PATH_DATA, "validation")
+
+PATH_MODEL = os.path.join(PATH_OUT, "model.hdf5")
+PATH_LABEL = os.path.join(PATH_OUT, "labels.dat")
+PATH_WEIGHTS = os.path.join(PATH_OUT, "model.npz")     # Model for the NumPy runtime
+PATH_QUANTIZED = os.path.join(PATH_OUT, "model_int8.npz")
+PATH_MANIFEST = os.path.join(PATH_OUT, "extracted.json")
+PATH_PROTOTYPES = os.path.join(PATH_OUT, "prototypes.npz")
+
+# Model of the segmentation-free engine, trained on whole captchas
+PATH_CAPTCHA_MODEL = os.path.join(PATH_OUT, "captcha_model.hdf5")
+PATH_CAPTCHA_LABEL = os.path.join(PATH_OUT, "captcha_labels.dat")
+
+# Kept outside of the output directory so it survives between runs
+PATH_CACHE = os.path.join(PATH_DATA, "cache", "segmentation.pkl")
+
+
+def cleanup(incremental):
+    """
+    Removes old results (only the solved captchas when incremental, as the
+    extracted letters and trained model are reused).
+
+    :param incremental: Boolean, whether the run is incremental.
+    :return: Boolean, whether the saved model can be warm started.
+    """
+    from data import isPackedLetters
+
+    isWarmStart = incremental and os.path.isfile(PATH_MODEL) and isPackedLetters(PATH_PACKED)
+    if incremental:
+        for solved in ("solved", "solved_correct", "solved_incorrect"):
+            shutil.rmtree(os.path.join(PATH_OUT, solved), ignore_errors=True)
+    else:
+        shutil.rmtree(PATH_OUT, ignore_errors=True)
     os.makedirs(PATH_OUT, exist_ok=True)
+    return isWarmStart
+
 
-    # Pre-rendering images
-    preRenderer = AnimationPreRenderer(ImageHandler(PATH_DATA))
-    preRenderer.generateLetterDetectionImages(pRender["fStart"], pRender["fEnd"])
-    preRenderer.generateOtsuImages(pRender["fStart"], pRender["fEnd"])
+def removeExtracted():
+    """
+    Removes the extracted letters and what was made while extracting them
+    (their packed dataset, the manifest and the letter detection images),
+    leaving the trained models and solved captchas alone.
+    """
+    for PATH_EXTRACTED in (PATH_TRAINING, PATH_PACKED, PATH_DETECTION):
+        shutil.rmtree(PATH_EXTRACTED, ignore_errors=True)
+    if os.path.isfile(PATH_MANIFEST):
+        os.remove(PATH_MANIFEST)
+
+
+def isKnownLabels(labels):
+    """
+    :param labels: Numpy Array, the labels of letters (e.g. "Z").
+    :return: Boolean, whether the saved model was trained on every one of the labels.
+    """
+    try:
+        with open(PATH_LABEL, "rb") as f:
+            knownLabels = set(pickle.load(f).classes_)
+    except FileNotFoundError:
+        return False
+    return set(labels) <= knownLabels
+
+
+def extract(segmentationCache, isAppended):
+    """
+    Extracts the letters of the captchas not extracted yet and packs them so
+    training doesn't have to decode them.
+
+    :param segmentationCache: SegmentationCache, cache consulted before detecting letters.
+    :param isAppended: Boolean, whether to only add the new letters to the
+    packed dataset rather than packing all letters again.
+    :return: List, the paths of the newly extracted letter images.
+    """
+    from data import ImageHandler, packLetters
+    from filter import AnimationPreRenderer
+    from writer import OutputWriter
+
+    with OutputWriter(PATH_DATA, pOutput["codec"], pOutput["quality"]) as outputWriter:
+        preRenderer = AnimationPreRenderer(ImageHandler(PATH_DATA), segmentationCache, outputWriter)
+        newLetters = preRenderer.generateLetterDetectionImages(pRender["fStart"], pRender["fEnd"],
+                                                               pRender["workers"], PATH_MANIFEST)
+
+    if not isAppended:
+        packLetters(PATH_TRAINING, PATH_PACKED)
+    elif newLetters:
+        packLetters(PATH_TRAINING, PATH_PACKED, newLetters)
+    return newLetters
+
+
+def render(segmentationCache):
+    """
+    Pre-renders the images shown in the viewer (except the solved captchas).
+
+    :param segmentationCache: SegmentationCache, cache consulted before detecting letters.
+    """
+    from data import ImageHandler
+    from filter import AnimationPreRenderer
+    from writer import OutputWriter
+
+    with OutputWriter(PATH_DATA, pOutput["codec"], pOutput["quality"]) as outputWriter:
+        preRenderer = AnimationPreRenderer(ImageHandler(PATH_DATA), segmentationCache, outputWriter)
+        preRenderer.generateOtsuImages(pRender["fStart"], pRender["fEnd"], pRender["workers"])
     # preRenderer.generateDifferenceImages(param["fStart"], param["fEnd"], param["fDiff"])
     # imageController = ImageController(param, PATH_DATA)
     # imageController.preRenderAllAnimation(param["fDiff"])
 
-    # Train our neural network
-    neuralNetwork = NeuralNetwork(PATH_TRAINING, PATH_MODEL, PATH_LABEL)
-    neuralNetwork.build()
-    neuralNetwork.train()
 
-    # Solve for our data
-    solver = Solver()
-    solver.run(PATH_VALIDATION, PATH_MODEL, PATH_LABEL)
+def train(isWarmStart):
+    """
+    Trains our neural network on the packed letters and exports it for the
+    NumPy runtime.
+
+    :param isWarmStart: Boolean, whether to continue training the saved model.
+    """
+    if pTrain["engine"] == "captcha":
+        trainCaptcha()
+        return
+
+    from data import readPackedLetters
+    from neural import NeuralNetwork
+    from runtime import buildPrototypes, compareModels, exportModelFiles, loadRuntime, quantizeModel
+
+    # Extracted letters may have labels the saved model can't predict, which
+    # only a model built from scratch can learn
+    if isWarmStart and not isKnownLabels(readPackedLetters(PATH_PACKED)[1]):
+        print("Letters have labels unknown to the saved model, retraining it from scratch")
+        isWarmStart = False
+
+    neuralNetwork = NeuralNetwork(PATH_PACKED, PATH_MODEL, PATH_LABEL)
+    if isWarmStart:
+        neuralNetwork.train(pTrain["epochsIncremental"], warmStart=True, streaming=pTrain["streaming"])
+    else:
+        neuralNetwork.build()
+        neuralNetwork.train(pTrain["epochs"], streaming=pTrain["streaming"])
 
-    # Choose display mode
-    imageController = ImageController(pRender, PATH_DATA)
+    # Export the model so solvers can start without Keras/TensorFlow
+    exportModelFiles(PATH_MODEL, PATH_LABEL, PATH_WEIGHTS)
+
+    # Letter prototypes for the first tier of the cascade (see runtime.CascadeModel)
+    data, labels = readPackedLetters(PATH_PACKED)
+    buildPrototypes(data, labels, loadRuntime(PATH_WEIGHTS)[1].classes_).save(PATH_PROTOTYPES)
+
+    if pTrain["quantize"]:
+        quantizeModel(PATH_WEIGHTS, PATH_QUANTIZED, readPackedLetters(PATH_PACKED)[0])
+        compareModels([PATH_WEIGHTS, PATH_QUANTIZED], PATH_VALIDATION)
+
+
+def trainCaptcha():
+    """
+    Trains the segmentation-free neural network on the whole captchas of
+    the data set of pTrain (labelled by their file names).
+    """
+    from neural import CaptchaNetwork
+
+    captchaNetwork = CaptchaNetwork(PATH_DATA, PATH_CAPTCHA_MODEL, PATH_CAPTCHA_LABEL, pTrain["dataset"])
+    captchaNetwork.build()
+    captchaNetwork.train(pTrain["epochsCaptcha"])
+
+
+def solve(segmentationCache, PATH_SOLVER_MODEL=None, streaming=False):
+    """
+    Solves the validation captchas with the engine of pTrain.
+
+    :param segmentationCache: SegmentationCache, cache consulted before detecting letters.
+    :param PATH_SOLVER_MODEL: String, the model to solve with (defaults to
+    the NumPy runtime model if exported, otherwise the Keras model).
+    :param streaming: Boolean, whether to solve in a streaming pipeline.
+    """
+    from solver import Solver
+    from writer import OutputWriter
+
+    PATH_SOLVER_LABEL = PATH_LABEL
+    if pTrain["engine"] == "captcha":
+        PATH_SOLVER_MODEL = PATH_SOLVER_MODEL or PATH_CAPTCHA_MODEL
+        PATH_SOLVER_LABEL = PATH_CAPTCHA_LABEL
+    elif PATH_SOLVER_MODEL is None:
+        PATH_SOLVER_MODEL = PATH_WEIGHTS if os.path.isfile(PATH_WEIGHTS) else PATH_MODEL
+
+    if pTrain["cascade"] and not os.path.isfile(PATH_PROTOTYPES):
+        print(f"Error: no letter prototypes at '{PATH_PROTOTYPES}', build them first with "
+              f"'python runtime.py prototypes {PATH_WEIGHTS} {PATH_PACKED} {PATH_PROTOTYPES}'")
+        return
+
+    solver = Solver(pTrain["engine"], PATH_PROTOTYPES if pTrain["cascade"] else None)
+    outputWriter = OutputWriter(PATH_DATA, pOutput["codec"], pOutput["quality"], pOutput["views"])
+    if streaming:
+        solver.runStreaming(PATH_VALIDATION, PATH_SOLVER_MODEL, PATH_SOLVER_LABEL,
+                            segmentationCache=segmentationCache, outputWriter=outputWriter)
+    else:
+        solver.run(PATH_VALIDATION, PATH_SOLVER_MODEL, PATH_SOLVER_LABEL, segmentationCache=segmentationCache,
+                   outputWriter=outputWriter)
+
+
+def view(segmentationCache=None):
+    """
+    Shows the captchas in the viewer.
+
+    :param segmentationCache: SegmentationCache, cache consulted before
+    detecting letters (live mode only).
+    """
+    from controller import ImageController
+
+    # Live mode draws the predictions of the trained model, if there is one
+    liveSolver = None
+    if pRender["live"] and (os.path.isfile(PATH_WEIGHTS) or os.path.isfile(PATH_MODEL)):
+        from solver import Solver
+        PATH_SOLVER_MODEL = PATH_WEIGHTS if os.path.isfile(PATH_WEIGHTS) else PATH_MODEL
+        solver = Solver()
+        model, labeller = solver.loadModel(PATH_SOLVER_MODEL, PATH_LABEL)
+        liveSolver = (solver, model, labeller)
+
+    imageController = ImageController(pRender, PATH_DATA, liveSolver, segmentationCache)
     imageController.runInteractiveMode()
     imageController.runAnimationMode(pRender["fInterval"], pRender["fSpeedFactor"])
 
 
+def closeInstrumentation(sink):
+    """
+    Prints the summary of the instrumentation (if aggregated) and closes its
+    sink, leaving instrumentation off afterwards.
+
+    :param sink: Sink, the sink configured for the run.
+    """
+    if isinstance(sink, instrument.AggregateSink):
+        print(json.dumps(sink.summary(), indent=4))
+    sink.close()
+    instrument.configure(instrument.NullSink())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyses captcha images and solves them with a neural network.")
+    parser.add_argument("--workers", type=int, default=pRender["workers"], help="processes used to pre-render")
+    commands = parser.add_subparsers(dest="command")
+
+    commandExtract = commands.add_parser("extract", help="extract the letters of the captchas")
+    commandExtract.add_argument("--fresh", action="store_true",
+                                help="discard the previously extracted letters, their packed dataset, manifest "
+                                     "and letter detection images (trained models and solved captchas are kept)")
+    commandRender = commands.add_parser("render", help="pre-render the images shown in the viewer")
+    commandRender.add_argument("--output", choices=("jpg", "png", "raw", "none"), default=pOutput["codec"],
+                               help="format of the rendered images")
+    commandRender.add_argument("--quality", type=int, default=pOutput["quality"],
+                               help="JPEG quality (0-100) or PNG compression (0-9)")
+    commandTrain = commands.add_parser("train", help="train the neural network on the extracted letters")
+    commandTrain.add_argument("--warm-start", action="store_true", help="continue training the saved model")
+    commandTrain.add_argument("--streaming", action="store_true", help="read letters from disk per batch")
+    commandTrain.add_argument("--quantize", action="store_true", help="also export an int8 model")
+    commandTrain.add_argument("--engine", choices=("letters", "captcha"), default=pTrain["engine"],
+                              help="train the letter model or the whole captcha model")
+    commandTrain.add_argument("--dataset", default=pTrain["dataset"],
+                              help="captchas of the whole captcha model, e.g. dataset/labelled.zip")
+    commandSolve = commands.add_parser("solve", help="solve the validation captchas")
+    commandSolve.add_argument("--model", help="Keras (.hdf5) or NumPy (.npz) model to solve with")
+    commandSolve.add_argument("--streaming", action="store_true", help="solve in a streaming pipeline")
+    commandSolve.add_argument("--engine", choices=("letters", "captcha"), default=pTrain["engine"],
+                              help="solve letter by letter or whole captchas")
+    commandSolve.add_argument("--cascade", action="store_true", help="try letter prototypes before the network")
+    commandSolve.add_argument("--output", choices=("jpg", "png", "raw", "none"), default=pOutput["codec"],
+                              help="format of the solved captchas ('none' only scores them)")
+    commandSolve.add_argument("--quality", type=int, default=pOutput["quality"],
+                              help="JPEG quality (0-100) or PNG compression (0-9)")
+    commandView = commands.add_parser("view", help="show the captchas in the viewer")
+    commandView.add_argument("--live", action="store_true", help="render the images on demand")
+    args = parser.parse_args()
+
+    pRender["workers"] = args.workers
+
+    # Instrumentation is off unless CAPTCHA_INSTRUMENTATION says otherwise
+    sink = instrument.configureFromEnvironment()
+    if args.command == "view":
+        pRender["live"] = args.live
+        if not args.live:
+            view()
+            closeInstrumentation(sink)
+            return
+
+    from filter import SegmentationCache
+    segmentationCache = SegmentationCache(PATH_CACHE)
+
+    if args.command == "extract":
+        if args.fresh:
+            removeExtracted()
+        from data import isPackedLetters
+        extract(segmentationCache, isAppended=isPackedLetters(PATH_PACKED))
+    elif args.command == "render":
+        pOutput["codec"] = args.output
+        pOutput["quality"] = args.quality
+        render(segmentationCache)
+    elif args.command == "train":
+        pTrain["streaming"] = args.streaming
+        pTrain["quantize"] = args.quantize
+        pTrain["engine"] = args.engine
+        pTrain["dataset"] = args.dataset
+        train(isWarmStart=args.warm_start)
+    elif args.command == "solve":
+        pTrain["engine"] = args.engine
+        pTrain["cascade"] = args.cascade
+        pOutput["codec"] = args.output
+        pOutput["quality"] = args.quality
+        solve(segmentationCache, args.model, args.streaming)
+    elif args.command == "view":
+        view(segmentationCache)
+    else:
+        isWarmStart = cleanup(pTrain["incremental"])
+        newLetters = extract(segmentationCache, isAppended=isWarmStart)
+        if not pRender["live"]:
+            render(segmentationCache)
+        segmentationCache.save()
+
+        # Train unless warm starting without anything new
+        if not isWarmStart or newLetters:
+            train(isWarmStart)
+        solve(segmentationCache)
+
+    segmentationCache.save()
+    if args.command is None:
+        view(segmentationCache)
+        segmentationCache.save()    # Regions detected by the live viewer
+    closeInstrumentation(sink)
+
+
 if __name__ == "__main__":
     main()
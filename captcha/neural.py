@@ -1,56 +1,79 @@
 """
 Contains the logic of the Neural Network.
 """
-import glob
+import os
 import pathlib
 import pickle
 
 import cv2
 import numpy as np
+from keras.layers import Input
 from keras.layers.convolutional import Conv2D, MaxPooling2D
 from keras.layers.core import Dense, Flatten
-from keras.models import Sequential
-from sklearn.model_selection import train_test_split
+from keras.models import Model, Sequential, load_model
+from keras.utils import Sequence
 from sklearn.preprocessing import LabelBinarizer
 
-from data import resizeToFit
+from data import ImageHandler, decodeLetters, isPackedLetters, readPackedLetters, splitIndices
+from source import openSource
+
+
+CAPTCHA_LENGTH = 4      # Number of characters in every captcha
+CAPTCHA_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"  # Every character a captcha may contain
 
 
 class NeuralNetwork:
 
-    def __init__(self, PATH_DATA, PATH_MODEL, PATH_LABEL):
+    def __init__(self, PATH_DATA, PATH_MODEL, PATH_LABEL, workers=None):
         """
         :param PATH_DATA: String, path to the data containing letter images.
         :param PATH_MODEL: String, path to the output model file.
         :param PATH_LABEL: String, path to the output labels file.
+        :param workers: Integer, the number of threads decoding letter images
+        (defaults to the number of processors).
         """
         self.PATH_DATA = PATH_DATA
         self.PATH_MODEL = PATH_MODEL
         self.PATH_LABEL = PATH_LABEL
+        self.workers = workers or os.cpu_count()
         self.model = None
 
     def loadData(self):
         """
-        Loads the images of individual letters from the given directory.
-        """
-        data = []
-        labels = []
+        Loads the images of individual letters, scaled to the range [0, 1].
 
-        for letter in glob.glob(f"{self.PATH_DATA}/*/*.jpg"):
-            img = cv2.imread(letter, 1)
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            img = resizeToFit(img, 20, 20)
-            img = np.expand_dims(img, axis=2)   # 3rd channel to make Keras happy
-            label = pathlib.PurePath(letter).parent.name
-
-            data.append(img)
-            labels.append(label)
+        :return: 2-Tuple, (lettersAsFloat32, labels)
+        """
+        data, labels = self.loadRawData()
 
         # scale the raw pixel intensities to the range [0, 1] (this improves training)
-        data = np.array(data, dtype="float") / 255.0
-        labels = np.array(labels)
+        data = np.asarray(data, dtype=np.float32) / 255.0
         return data, labels
 
+    def loadRawData(self):
+        """
+        Loads the images of individual letters as they are stored, i.e. as
+        uint8 in the range [0, 255].
+
+        PATH_DATA is either a packed dataset (see data.packLetters), which is
+        memory-mapped, or a directory tree (or zip/tar archive) of
+        <LABEL>/<NUM>.jpg letter images, which is decoded.
+
+        :return: 2-Tuple, (lettersAsUint8, labels)
+        """
+        if isPackedLetters(self.PATH_DATA):
+            return readPackedLetters(self.PATH_DATA)
+        source = openSource(self.PATH_DATA)
+        return decodeLetters(self._letterPaths(source), self.workers, source)
+
+    @staticmethod
+    def _letterPaths(source):
+        """
+        :param source: Source, the directory or archive of letter images.
+        :return: List, the sorted paths of its <LABEL>/<NUM>.jpg letter images.
+        """
+        return sorted(source.path(name) for name in source.glob("*/*.jpg"))
+
     def build(self):
         """
         Builds a neural network for analysing captcha images.
@@ -73,25 +96,94 @@ class NeuralNetwork:
 
         self.model = model
 
-    def train(self):
+    def load(self):
         """
-        Trains the neural network.
+        Loads the previously trained neural network and its labels, e.g. to
+        continue training it.
+
+        :return: sklearn.preprocessing.label.LabelBinarizer, the labels.
         """
-        data, labels = self.loadData()
-        Xtrain, Xtest, Ytrain, Ytest = train_test_split(data, labels, test_size=0.25, random_state=0)
+        self.model = load_model(self.PATH_MODEL)
+        with open(self.PATH_LABEL, "rb") as f:
+            return pickle.load(f)
 
-        # Convert the labels (letters) into one-hot encodings that Keras can work with
-        lb = LabelBinarizer().fit(Ytrain)
-        Ytrain = lb.transform(Ytrain)
-        Ytest = lb.transform(Ytest)
+    def loadLetterSource(self):
+        """
+        Opens the letters without loading them into memory: a packed dataset
+        is memory-mapped and a directory tree (or archive) is decoded on access.
+
+        :return: 2-Tuple, (lettersIndexableByArrays, labels)
+        """
+        if isPackedLetters(self.PATH_DATA):
+            return readPackedLetters(self.PATH_DATA)
+
+        source = openSource(self.PATH_DATA)
+        letterFiles = LetterFiles(self._letterPaths(source), self.workers, source)
+        return letterFiles, letterFiles.labels
+
+    def _fitLabeller(self, trainLabels, labels, warmStart):
+        """
+        Fits the one-hot encodings of the labels and saves them.
+
+        :param trainLabels: Numpy Array, the labels of the training letters.
+        :param labels: Numpy Array, the labels of all letters.
+        :param warmStart: Boolean, whether to reuse the saved labels (and model).
+        :return: sklearn.preprocessing.label.LabelBinarizer, the labels.
+        """
+        # A warm started model must keep the mapping it was trained with
+        if warmStart:
+            lb = self.load()
+            unknown = set(labels) - set(lb.classes_)
+            if unknown:
+                raise ValueError(f"Labels {sorted(unknown)} are unknown to the saved model, retrain from scratch")
+        else:
+            lb = LabelBinarizer().fit(trainLabels)
 
         # Save the mapping from labels to one-hot encodings.
         # We'll need this later when we use the model to decode what it's predictions mean
         with open(self.PATH_LABEL, "wb") as f:
             pickle.dump(lb, f)
+        return lb
+
+    def train(self, epochs=5, warmStart=False, streaming=False, batchSize=32):
+        """
+        Trains the neural network.
+
+        :param epochs: Integer, the number of passes over the training data.
+        :param warmStart: Boolean, whether to continue training the saved
+        model with its saved labels, rather than the freshly built model.
+        :param streaming: Boolean, whether to read the letters from disk one
+        batch at a time (see LetterSequence) rather than all up front, which
+        keeps memory flat however large the dataset is.
+        :param batchSize: Integer, the number of letters per training step.
+        """
+        if streaming:
+            data, labels = self.loadLetterSource()
+            trainIndices, testIndices = splitIndices(len(labels), testSize=0.25, seed=0)
+            lb = self._fitLabeller(labels[trainIndices], labels, warmStart)
+
+            train = LetterSequence(data, labels, trainIndices, lb, batchSize, isShuffled=True)
+            test = LetterSequence(data, labels, testIndices, lb, batchSize)
+            history = self.model.fit_generator(train, validation_data=test, epochs=epochs, verbose=1)
+        else:
+            data, labels = self.loadRawData()
+            trainIndices, testIndices = splitIndices(len(labels), testSize=0.25, seed=0)
+            Xtrain, Xtest = data[trainIndices], data[testIndices]
+            Ytrain, Ytest = labels[trainIndices], labels[testIndices]
+
+            # scale the raw pixel intensities to the range [0, 1] (this improves training)
+            Xtrain = Xtrain.astype(np.float32) / 255.0
+            Xtest = Xtest.astype(np.float32) / 255.0
+
+            # Convert the labels (letters) into one-hot encodings that Keras can work with
+            lb = self._fitLabeller(Ytrain, labels, warmStart)
+            Ytrain = lb.transform(Ytrain)
+            Ytest = lb.transform(Ytest)
+
+            # train the neural network
+            history = self.model.fit(Xtrain, Ytrain, validation_data=(Xtest, Ytest), batch_size=batchSize,
+                                     epochs=epochs, verbose=1)
 
-        # train the neural network
-        history = self.model.fit(Xtrain, Ytrain, validation_data=(Xtest, Ytest), batch_size=32, epochs=5, verbose=1)
         self.model.save(self.PATH_MODEL)
 
         # import matplotlib.pyplot as plt
@@ -113,3 +205,172 @@ class NeuralNetwork:
         # plt.legend(['Train', 'Test'], loc='upper left')
         # plt.show()
 
+
+class CaptchaNetwork:
+    """
+    Responsible for the segmentation-free neural network, which reads the
+    whole captcha and predicts its four characters in a single forward pass
+    (one softmax output per position), so it never depends on the letters
+    being detected correctly.
+    """
+
+    def __init__(self, PATH_DATA, PATH_MODEL, PATH_LABEL, dataset="training"):
+        """
+        :param PATH_DATA: String, path to the root data directory.
+        :param PATH_MODEL: String, path to the output model file.
+        :param PATH_LABEL: String, path to the output labels file.
+        :param dataset: String, the directory or archive of captchas (relative
+        to PATH_DATA) to train on, e.g. "training" or "dataset/labelled.zip".
+        """
+        self.imageHandler = ImageHandler(PATH_DATA)
+        self.dataset = dataset
+        self.PATH_MODEL = PATH_MODEL
+        self.PATH_LABEL = PATH_LABEL
+        self.model = None
+
+    def loadRawData(self):
+        """
+        Loads the captchas as grayscale uint8 in the range [0, 255], labelled
+        by their file names.
+
+        :return: 2-Tuple, (captchasAsUint8, labels)
+        """
+        index = self.imageHandler.index(self.dataset)
+        entries = [index[num] for num in sorted(index)
+                   if len(index[num][1]) == CAPTCHA_LENGTH and set(index[num][1]) <= set(CAPTCHA_ALPHABET)]
+
+        data = np.empty((len(entries), 20, 60, 1), dtype=np.uint8)
+        for i, (_, _, num) in enumerate(entries):
+            data[i, :, :, 0] = self.imageHandler.read(int(num), self.dataset, cv2.IMREAD_GRAYSCALE)[0]
+        labels = np.array([label for _, label, _ in entries])
+        return data, labels
+
+    def build(self, numberClasses=len(CAPTCHA_ALPHABET)):
+        """
+        Builds a neural network for reading whole captcha images.
+
+        :param numberClasses: Integer, the number of possible characters.
+        """
+        captcha = Input(shape=(20, 60, 1))
+
+        # Two convolutional layers with max pooling, shared by every position
+        x = Conv2D(32, (3, 3), padding="same", activation="relu")(captcha)
+        x = MaxPooling2D(pool_size=(2, 2))(x)
+        x = Conv2D(64, (3, 3), padding="same", activation="relu")(x)
+        x = MaxPooling2D(pool_size=(2, 2))(x)
+
+        # Hidden layer with 512 nodes
+        x = Flatten()(x)
+        x = Dense(512, activation="relu")(x)
+
+        # An output layer per character of the captcha
+        outputs = [Dense(numberClasses, activation="softmax", name=f"letter{i}")(x)
+                   for i in range(CAPTCHA_LENGTH)]
+
+        model = Model(inputs=captcha, outputs=outputs)
+        model.compile(loss="categorical_crossentropy", optimizer="adam", metrics=["accuracy"])
+        self.model = model
+
+    def train(self, epochs=20, batchSize=32):
+        """
+        Trains the neural network.
+
+        :param epochs: Integer, the number of passes over the training data.
+        :param batchSize: Integer, the number of captchas per training step.
+        """
+        data, labels = self.loadRawData()
+        trainIndices, testIndices = splitIndices(len(labels), testSize=0.25, seed=0)
+        Xtrain, Xtest = data[trainIndices], data[testIndices]
+        Ytrain, Ytest = labels[trainIndices], labels[testIndices]
+
+        # scale the raw pixel intensities to the range [0, 1] (this improves training)
+        Xtrain = Xtrain.astype(np.float32) / 255.0
+        Xtest = Xtest.astype(np.float32) / 255.0
+
+        # One-hot encode each position of the captchas separately, over the
+        # whole alphabet so the encodings match the output layers even when
+        # the data set lacks some characters
+        lb = LabelBinarizer().fit(list(CAPTCHA_ALPHABET))
+        Ytrain = [lb.transform([label[i] for label in Ytrain]) for i in range(CAPTCHA_LENGTH)]
+        Ytest = [lb.transform([label[i] for label in Ytest]) for i in range(CAPTCHA_LENGTH)]
+
+        with open(self.PATH_LABEL, "wb") as f:
+            pickle.dump(lb, f)
+
+        self.model.fit(Xtrain, Ytrain, validation_data=(Xtest, Ytest), batch_size=batchSize,
+                       epochs=epochs, verbose=1)
+        self.model.save(self.PATH_MODEL)
+
+
+class LetterFiles:
+    """
+    Responsible for decoding letter images from a directory tree (or archive)
+    only when they are indexed (like a read-only array of letters).
+    """
+
+    def __init__(self, PATH_LETTERS, workers=None, source=None):
+        """
+        :param PATH_LETTERS: List, paths of letter images (stored as <LABEL>/<NUM>.jpg).
+        :param workers: Integer, the number of threads decoding letter images.
+        :param source: Source, optional directory or archive the paths belong to.
+        """
+        self.PATH_LETTERS = np.array(PATH_LETTERS)
+        self.labels = np.array([pathlib.PurePath(letter).parent.name for letter in PATH_LETTERS])
+        self.workers = workers
+        self.source = source
+
+    def __len__(self):
+        return len(self.PATH_LETTERS)
+
+    def __getitem__(self, indices):
+        """
+        :param indices: Numpy Array, the indices of the letters to decode.
+        :return: Numpy Array, (N, 20, 20, 1) the letters as uint8.
+        """
+        data, _ = decodeLetters(self.PATH_LETTERS[indices], self.workers, self.source)
+        return data
+
+
+class LetterSequence(Sequence):
+    """
+    Responsible for feeding Keras one batch of letters at a time, read from
+    disk and scaled to float32 only when the batch is needed.
+    """
+
+    def __init__(self, data, labels, indices, labeller, batchSize=32, isShuffled=False, seed=0):
+        """
+        :param data: Indexable by arrays, the uint8 letters (e.g. a memmap).
+        :param labels: Numpy Array, the label of each letter.
+        :param indices: Numpy Array, the indices of the letters to use.
+        :param labeller: sklearn.preprocessing.label.LabelBinarizer, contains labels.
+        :param batchSize: Integer, the number of letters per batch.
+        :param isShuffled: Boolean, whether to shuffle the letters every epoch.
+        :param seed: Integer, seed of the shuffling (for reproducible runs).
+        """
+        self.data = data
+        self.labels = labels
+        self.indices = np.array(indices)
+        self.labeller = labeller
+        self.batchSize = batchSize
+        self.isShuffled = isShuffled
+        self.random = np.random.RandomState(seed)
+        if isShuffled:
+            self.random.shuffle(self.indices)
+
+    def __len__(self):
+        return int(np.ceil(len(self.indices) / self.batchSize))
+
+    def __getitem__(self, batch):
+        """
+        :param batch: Integer, the number of the batch.
+        :return: 2-Tuple, (lettersAsFloat32, oneHotLabels)
+        """
+        # Sorted indices read the data sequentially
+        indices = np.sort(self.indices[batch*self.batchSize:(batch+1)*self.batchSize])
+        X = np.asarray(self.data[indices], dtype=np.float32) / 255.0
+        Y = self.labeller.transform(self.labels[indices])
+        return X, Y
+
+    def on_epoch_end(self):
+        if self.isShuffled:
+            self.random.shuffle(self.indices)
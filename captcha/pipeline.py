@@ -0,0 +1,210 @@
+"""
+Module that contains the streaming pipeline for solving captchas.
+"""
+
+import queue
+import threading
+import time
+
+from results import SolveResults
+
+
+DONE = object()     # Marks the end of a stream in a queue
+
+
+class StageStats:
+    """
+    Responsible for measuring the throughput of a single pipeline stage.
+    """
+
+    def __init__(self, name):
+        """
+        :param name: String, the name of the stage.
+        """
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items, seconds):
+        """
+        :param items: Integer, the number of items processed.
+        :param seconds: Float, the time spent processing them.
+        """
+        with self.lock:
+            self.items += items
+            self.busy += seconds
+
+    def report(self, elapsed):
+        """
+        :param elapsed: Float, the wall-clock time of the whole pipeline.
+        :return: Dictionary, the measurements of the stage.
+        """
+        return {
+            "items": self.items,
+            "busySeconds": self.busy,
+            "itemsPerBusySecond": self.items / self.busy if self.busy else 0.0,
+            "itemsPerSecond": self.items / elapsed if elapsed else 0.0,
+        }
+
+
+class SolvePipeline:
+    """
+    Responsible for solving captchas as a stream where reading, solving and
+    writing overlap instead of taking turns:
+
+        reader threads -> bounded queue -> solver (batches) -> bounded queue -> writer threads
+
+    The solving happens on the calling thread, as Keras models are not
+    meant to be shared between threads.
+    """
+
+    def __init__(self, solver, model, labeller, imageFilter, imageHandler,
+                 batchSize, readers=2, writers=2, queueSize=None):
+        """
+        :param solver: Solver, used to solve batches of captchas.
+        :param model: keras.engine.sequential.Sequential, the neural network model.
+        :param labeller: sklearn.preprocessing.label.LabelBinarizer, contains labels.
+        :param imageFilter: ImageFilter, used to detect the letters.
+        :param imageHandler: ImageHandler, used to read and write the images.
+        :param batchSize: Integer, the largest number of captchas solved at once.
+        :param readers: Integer, the number of threads reading images.
+        :param writers: Integer, the number of threads writing images.
+        :param queueSize: Integer, the capacity of the queues between stages.
+        """
+        self.solver = solver
+        self.model = model
+        self.labeller = labeller
+        self.imageFilter = imageFilter
+        self.imageHandler = imageHandler
+        self.batchSize = batchSize
+        self.readers = readers
+        self.writers = writers
+        self.queueSize = queueSize or 4*batchSize
+        self.stats = {name: StageStats(name) for name in ("read", "solve", "write")}
+        self.errors = []
+
+    def run(self, imageNums, PATH_SEARCH_DIR, write):
+        """
+        Solves the captchas with the given numbers.
+
+        :param imageNums: Iterable, containing the integer image numbers.
+        :param PATH_SEARCH_DIR: String, path relative to the 'data' directory.
+        :param write: Function, called as write(outImage, solution, num, captcha)
+        from the writer threads to store a solved captcha (None to only score
+        the captchas, which skips drawing them as well).
+        :return: 2-Tuple, (SolveResults, statsPerStage)
+        """
+        timeStart = time.perf_counter()
+        pending = queue.Queue()
+        decoded = queue.Queue(self.queueSize)
+        solved = queue.Queue(self.queueSize)
+
+        for imageNum in imageNums:
+            pending.put(imageNum)
+
+        readers = [threading.Thread(target=self._read, args=(pending, decoded, PATH_SEARCH_DIR), daemon=True)
+                   for _ in range(self.readers)]
+        writers = [threading.Thread(target=self._write, args=(solved, write), daemon=True)
+                   for _ in range(self.writers if write is not None else 0)]
+        for thread in readers + writers:
+            thread.start()
+
+        try:
+            results = self._solve(decoded, solved if write is not None else None)
+        finally:
+            for _ in writers:
+                solved.put(DONE)
+            for thread in writers:
+                thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+        elapsed = time.perf_counter() - timeStart
+        stats = {name: stage.report(elapsed) for name, stage in self.stats.items()}
+        stats["total"] = {"seconds": elapsed, "itemsPerSecond": len(results) / elapsed if elapsed else 0.0}
+        return results, stats
+
+    def _read(self, pending, decoded, PATH_SEARCH_DIR):
+        """
+        Reader thread: decodes images until there are no more to read.
+        """
+        try:
+            while True:
+                try:
+                    imageNum = pending.get_nowait()
+                except queue.Empty:
+                    break
+                timeStart = time.perf_counter()
+                item = self.imageHandler.read(imageNum, PATH_SEARCH_DIR)
+                self.stats["read"].add(1, time.perf_counter() - timeStart)
+                decoded.put(item)
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            decoded.put(DONE)
+
+    def _solve(self, decoded, solved):
+        """
+        Solves the decoded images in batches of whatever is available (up to
+        the batch size) until every reader is done.
+
+        :param decoded: Queue, the images read.
+        :param solved: Queue, the solved captchas to write (None to not draw them).
+        :return: SolveResults, the results of every captcha solved.
+        """
+        results = []
+        readersLeft = self.readers
+
+        while readersLeft:
+            # Block for the first item, then take whatever else is ready
+            batch = []
+            item = decoded.get()
+            while True:
+                if item is DONE:
+                    readersLeft -= 1
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batchSize or not readersLeft:
+                    break
+                try:
+                    item = decoded.get_nowait()
+                except queue.Empty:
+                    break
+
+            if not batch:
+                continue
+
+            timeStart = time.perf_counter()
+            images = [img for img, _, _ in batch]
+            imageIds = [int(num) for _, _, num in batch]
+            solutions = [solution for _, solution, _ in batch]
+            batchResults = self.solver.predictBatch(images, self.model, self.labeller, self.imageFilter,
+                                                    self.batchSize, imageIds, solutions)
+            outImages = self.solver.drawResults(images, batchResults) if solved is not None else None
+            self.stats["solve"].add(len(batch), time.perf_counter() - timeStart)
+
+            results.append(batchResults)
+            if solved is None:
+                continue
+            for (_, solution, num), captcha, outImage in zip(batch, batchResults.captchas(), outImages):
+                solved.put((outImage, solution, num, captcha))
+        return SolveResults.concatenate(results)
+
+    def _write(self, solved, write):
+        """
+        Writer thread: stores solved captchas until told it is done.
+        """
+        while True:
+            item = solved.get()
+            if item is DONE:
+                break
+            if self.errors:
+                continue
+            try:
+                timeStart = time.perf_counter()
+                write(*item)
+                self.stats["write"].add(1, time.perf_counter() - timeStart)
+            except Exception as e:
+                self.errors.append(e)
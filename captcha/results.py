@@ -0,0 +1,78 @@
+"""
+Module that contains the records of solved captchas.
+"""
+
+import numpy as np
+
+
+class SolveResults:
+    """
+    Responsible for holding the results of solving captchas as arrays with
+    one row per captcha (rather than Python objects per letter), so they can
+    be concatenated and scored without loops.
+
+    Every captcha solved is a row of its own, even when several captchas
+    share the same solution.
+    """
+
+    def __init__(self, imageIds, letterRegions, letterClasses, confidences, classes, solutions=None):
+        """
+        :param imageIds: Numpy Array, (N,) the number of each captcha image.
+        :param letterRegions: Numpy Array, (N, 4, 4) the (x0, y0, x1, y1) of each letter.
+        :param letterClasses: Numpy Array, (N, 4) the predicted class index of each letter.
+        :param confidences: Numpy Array, (N, 4) the probability of each predicted letter.
+        :param classes: Numpy Array, the label of each class index.
+        :param solutions: Numpy Array, (N,) the expected solution of each
+        captcha (empty strings when unknown).
+        """
+        self.imageIds = np.asarray(imageIds, dtype=np.int64)
+        self.letterRegions = np.asarray(letterRegions, dtype=np.int16)
+        self.letterClasses = np.asarray(letterClasses, dtype=np.uint8)
+        self.confidences = np.asarray(confidences, dtype=np.float32)
+        self.classes = np.asarray(classes, dtype="<U1")
+        if solutions is None:
+            solutions = np.full(len(self.imageIds), "")
+        self.solutions = np.asarray(solutions, dtype="<U4")
+
+    def __len__(self):
+        return len(self.imageIds)
+
+    @classmethod
+    def concatenate(cls, results):
+        """
+        :param results: List, containing SolveResults (with the same classes).
+        :return: SolveResults, the rows of every given result in order.
+        """
+        if not results:
+            return cls(np.empty(0), np.empty((0, 4, 4)), np.empty((0, 4)), np.empty((0, 4)), np.empty(0))
+        return cls(np.concatenate([r.imageIds for r in results]),
+                   np.concatenate([r.letterRegions for r in results]),
+                   np.concatenate([r.letterClasses for r in results]),
+                   np.concatenate([r.confidences for r in results]),
+                   results[0].classes,
+                   np.concatenate([r.solutions for r in results]))
+
+    def letters(self):
+        """
+        :return: Numpy Array, (N, 4) the predicted letters.
+        """
+        return self.classes[self.letterClasses]
+
+    def captchas(self):
+        """
+        :return: Numpy Array, (N,) the predicted captchas as strings.
+        """
+        return np.ascontiguousarray(self.letters()).view("<U4").reshape(len(self))
+
+    def letterCorrect(self):
+        """
+        :return: Numpy Array, (N, 4) whether each letter was solved correctly.
+        """
+        expected = np.ascontiguousarray(self.solutions).view("<U1").reshape(len(self), 4)
+        return self.letters() == expected
+
+    def correct(self):
+        """
+        :return: Numpy Array, (N,) whether each captcha was solved correctly.
+        """
+        return self.letterCorrect().all(axis=1)
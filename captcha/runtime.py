@@ -0,0 +1,623 @@
+"""
+Module that contains a NumPy-only inference engine for the trained letter
+classifier, so captchas can be solved without importing Keras/TensorFlow.
+
+The trained Keras model and its labels are first exported to a plain
+weights file (see exportModel), which the engine then loads in milliseconds.
+The hidden layer, which holds most of the weights, can then optionally be
+quantized to int8 (see quantizeModel), which makes the model about four
+times smaller, on disk and in memory, at a measured cost in accuracy and
+speed (see compareModels).
+
+Usage:
+    python runtime.py quantize model.npz letters_packed model_int8.npz
+    python runtime.py compare model.npz model_int8.npz ../data/validation
+    python runtime.py prototypes model.npz letters_packed prototypes.npz
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+import instrument
+
+
+QUANTIZED_BLOCK = 512   # Number of int8 hidden nodes dequantized at a time
+PROTOTYPE_PIXELS = 20 * 20      # Size of the letters compared to the prototypes
+
+
+def exportModel(model, labeller, PATH_WEIGHTS):
+    """
+    Exports a trained letter classifier (see NeuralNetwork.build) and its
+    labels to a plain weights file.
+
+    :param model: keras.engine.sequential.Sequential, the trained model.
+    :param labeller: sklearn.preprocessing.label.LabelBinarizer, contains labels.
+    :param PATH_WEIGHTS: String, path to the weights file (.npz).
+    """
+    convKernel, convBias = model.layers[0].get_weights()
+    poolSize = model.layers[1].pool_size
+    poolStrides = model.layers[1].strides
+    hiddenKernel, hiddenBias = model.layers[3].get_weights()
+    outputKernel, outputBias = model.layers[4].get_weights()
+
+    np.savez(PATH_WEIGHTS,
+             convKernel=convKernel, convBias=convBias,
+             poolSize=np.array(poolSize), poolStrides=np.array(poolStrides),
+             hiddenKernel=hiddenKernel, hiddenBias=hiddenBias,
+             outputKernel=outputKernel, outputBias=outputBias,
+             classes=np.asarray(labeller.classes_, dtype=str))
+
+
+def exportModelFiles(PATH_MODEL, PATH_LABEL, PATH_WEIGHTS):
+    """
+    Same as exportModel, but for a model and labels saved to disk.
+
+    :param PATH_MODEL: String, path to the trained model file.
+    :param PATH_LABEL: String, path to the labels file.
+    :param PATH_WEIGHTS: String, path to the weights file (.npz).
+    """
+    import pickle
+    from keras.models import load_model
+
+    with open(PATH_LABEL, "rb") as f:
+        labeller = pickle.load(f)
+    exportModel(load_model(PATH_MODEL), labeller, PATH_WEIGHTS)
+
+
+def loadRuntime(PATH_WEIGHTS):
+    """
+    :param PATH_WEIGHTS: String, path to the weights file (.npz).
+    :return: 2-Tuple, (NumpyModel, NumpyLabeller), which can be used in place
+    of the Keras model and LabelBinarizer.
+    """
+    weights = np.load(PATH_WEIGHTS)
+    if "hiddenScales" in weights:
+        return QuantizedNumpyModel(weights), NumpyLabeller(weights["classes"])
+    return NumpyModel(weights), NumpyLabeller(weights["classes"])
+
+
+def quantizeModel(PATH_WEIGHTS, PATH_QUANTIZED, calibrationLetters, percentile=99.99):
+    """
+    Quantizes the hidden layer of an exported model to int8 weights (one
+    scale per output node) and uint8 inputs (one scale calibrated on the
+    given letters). The other, much smaller, layers are kept as float32.
+
+    :param PATH_WEIGHTS: String, path to the exported weights file (.npz).
+    :param PATH_QUANTIZED: String, path to the quantized weights file (.npz).
+    :param calibrationLetters: Numpy Array, (N, 20, 20, 1) letters, fed
+    exactly as the solver feeds them (i.e. uint8 in the range [0, 255]).
+    :param percentile: Float, percentile of the calibration inputs mapped to
+    the largest uint8 (ignoring rare outliers keeps resolution for the rest).
+    """
+    weights = dict(np.load(PATH_WEIGHTS))
+    model = NumpyModel(weights)
+
+    # Calibrate the range of the inputs of the hidden layer
+    features = np.concatenate([model._flatten(np.asarray(calibrationLetters[i:i+1024], dtype=np.float32))
+                               for i in range(0, len(calibrationLetters), 1024)])
+    inputMax = float(np.percentile(features, percentile)) or float(features.max()) or 1.0
+
+    # Symmetric int8 weights, one scale per hidden node
+    kernel = weights.pop("hiddenKernel")
+    scales = np.abs(kernel).max(axis=0) / 127.0
+    scales[scales == 0] = 1.0
+    weights["hiddenKernelInt8"] = np.clip(np.round(kernel / scales), -127, 127).astype(np.int8)
+    weights["hiddenScales"] = scales.astype(np.float32)
+    weights["hiddenInputScale"] = np.float32(inputMax / 255.0)
+    np.savez(PATH_QUANTIZED, **weights)
+
+
+class NumpyModel:
+    """
+    Responsible for running the letter classifier with NumPy only:
+    convolution (ReLU), max pooling, dense (ReLU), dense (softmax).
+    """
+
+    def __init__(self, weights):
+        """
+        :param weights: Mapping, the arrays saved by exportModel.
+        """
+        self.convKernel = weights["convKernel"].astype(np.float32)
+        self.convBias = weights["convBias"].astype(np.float32)
+        self.poolSize = tuple(int(p) for p in weights["poolSize"])
+        self.poolStrides = tuple(int(s) for s in weights["poolStrides"])
+        self.hiddenKernel = weights["hiddenKernel"].astype(np.float32)
+        self.hiddenBias = weights["hiddenBias"].astype(np.float32)
+        self.outputKernel = weights["outputKernel"].astype(np.float32)
+        self.outputBias = weights["outputBias"].astype(np.float32)
+
+        # The convolution is a single matrix product over image patches
+        kh, kw, channels, filters = self.convKernel.shape
+        self.convMatrix = self.convKernel.reshape(kh * kw * channels, filters)
+
+    def residentBytes(self):
+        """
+        :return: Integer, the memory held by the weights of the model.
+        """
+        return sum(value.nbytes for value in vars(self).values() if isinstance(value, np.ndarray))
+
+    def predict(self, x, batch_size=None):
+        """
+        Predicts the probability of each label for a batch of letters, in
+        the same way as the Keras model.
+
+        :param x: Numpy Array, (N, 20, 20, 1) letter images.
+        :param batch_size: Integer, optional number of letters per pass (bounds memory).
+        :return: Numpy Array, (N, numberLabels) probabilities.
+        """
+        x = np.asarray(x, dtype=np.float32)
+        if not batch_size or batch_size >= len(x):
+            return self._forward(x)
+        return np.concatenate([self._forward(x[i:i+batch_size]) for i in range(0, len(x), batch_size)])
+
+    def _forward(self, x):
+        """
+        :param x: Numpy Array, (N, H, W, C) float32 letter images.
+        :return: Numpy Array, (N, numberLabels) probabilities.
+        """
+        hidden = self._dense(self._flatten(x), self.hiddenKernel, self.hiddenBias)
+        np.maximum(hidden, 0, out=hidden)
+        return softmax(self._dense(hidden, self.outputKernel, self.outputBias))
+
+    def _flatten(self, x):
+        """
+        Runs the convolution and pooling layers and flattens the result (in
+        the channels-last order of Keras).
+
+        :param x: Numpy Array, (N, H, W, C) float32 letter images.
+        :return: Numpy Array, (N, features) float32.
+        """
+        kh, kw = self.convKernel.shape[:2]
+        conv = windows(x, (kh, kw), (1, 1))                     # N, H', W', C, kh, kw
+        conv = conv.transpose(0, 1, 2, 4, 5, 3)                 # N, H', W', kh, kw, C
+        n, h, w = conv.shape[:3]
+        conv = conv.reshape(n * h * w, -1) @ self.convMatrix
+        conv += self.convBias
+        np.maximum(conv, 0, out=conv)
+        conv = conv.reshape(n, h, w, -1)
+
+        pooled = windows(conv, self.poolSize, self.poolStrides).max(axis=(4, 5))
+        return pooled.reshape(n, -1)
+
+    def _dense(self, x, kernel, bias):
+        """
+        :param x: Numpy Array, (N, inputs) activations.
+        :param kernel: Numpy Array, (inputs, outputs) weights.
+        :param bias: Numpy Array, (outputs,) biases.
+        :return: Numpy Array, (N, outputs) activations before the activation function.
+        """
+        out = x @ kernel
+        out += bias
+        return out
+
+
+class QuantizedNumpyModel(NumpyModel):
+    """
+    Same as NumpyModel, but the hidden layer keeps its int8 weights (with a
+    scale per hidden node) and its inputs are quantized to uint8, which
+    makes the weights of the model about four times smaller in memory.
+
+    NumPy has no int8 matrix product, so the integer product is carried out
+    by the float32 one, a block of hidden nodes dequantized at a time, and
+    rescaled afterwards. This saves memory, not time: it runs slightly
+    slower than the float model (see compareModels for measurements).
+    """
+
+    def __init__(self, weights):
+        """
+        :param weights: Mapping, the arrays saved by quantizeModel.
+        """
+        weights = dict(weights)
+        weights["hiddenKernel"] = np.zeros((0, 0), dtype=np.float32)
+        super().__init__(weights)
+        self.hiddenKernel = weights["hiddenKernelInt8"]
+        self.hiddenInputScale = np.float32(weights["hiddenInputScale"])
+        # Rescales the integer products of the hidden layer in a single pass
+        self.hiddenOutputScales = weights["hiddenScales"].astype(np.float32) * self.hiddenInputScale
+
+    def _forward(self, x):
+        """
+        :param x: Numpy Array, (N, H, W, C) float32 letter images.
+        :return: Numpy Array, (N, numberLabels) probabilities.
+        """
+        # Quantize the inputs of the hidden layer to uint8
+        features = self._flatten(x)
+        features /= self.hiddenInputScale
+        np.clip(np.rint(features, out=features), 0, 255, out=features)
+
+        hidden = np.empty((len(features), self.hiddenKernel.shape[1]), dtype=np.float32)
+        for j in range(0, hidden.shape[1], QUANTIZED_BLOCK):
+            block = self.hiddenKernel[:, j:j+QUANTIZED_BLOCK].astype(np.float32)
+            np.matmul(features, block, out=hidden[:, j:j+QUANTIZED_BLOCK])
+        hidden *= self.hiddenOutputScales
+        hidden += self.hiddenBias
+        np.maximum(hidden, 0, out=hidden)
+        return softmax(self._dense(hidden, self.outputKernel, self.outputBias))
+
+
+class TimedModel:
+    """
+    Responsible for timing the predictions of the model it wraps (and
+    nothing else of solving), so models can be compared on latency. It
+    predicts like the model it wraps, so it can be used in its place.
+    """
+
+    def __init__(self, model):
+        """
+        :param model: The model to time.
+        """
+        self.model = model
+        self.letters = 0
+        self.seconds = 0.0
+
+    def predict(self, x, batch_size=None):
+        """
+        :param x: Numpy Array, (N, 20, 20, 1) letter images.
+        :param batch_size: Integer, optional number of letters per pass of the model.
+        :return: Numpy Array, (N, numberLabels) probabilities.
+        """
+        timeStart = time.perf_counter()
+        predictions = self.model.predict(x, batch_size=batch_size)
+        self.seconds += time.perf_counter() - timeStart
+        self.letters += len(x)
+        return predictions
+
+
+class NumpyLabeller:
+    """
+    Responsible for turning predicted probabilities back into labels, in
+    the same way as LabelBinarizer.inverse_transform.
+    """
+
+    def __init__(self, classes):
+        """
+        :param classes: Numpy Array, the labels in the order of the model outputs.
+        """
+        self.classes_ = np.asarray(classes)
+
+    def inverse_transform(self, predictions):
+        """
+        :param predictions: Numpy Array, (N, numberLabels) probabilities.
+        :return: Numpy Array, (N,) the most likely labels.
+        """
+        return self.classes_[np.argmax(predictions, axis=1)]
+
+
+def buildPrototypes(data, labels, classes, perClass=8, precision=0.999, iterations=10, seed=0, heldOut=0.25):
+    """
+    Builds an index of letter prototypes: a few cluster centres (k-means)
+    per label, so that the different renderings of a letter each get one.
+
+    The index only answers letters it is confident about. The confidence
+    threshold is calibrated on held-out letters that the prototypes are not
+    fitted on, as the largest ratio of distances (see PrototypeIndex.match)
+    at which the answers are still right for the given fraction of them.
+    With the default split (see data.splitIndices), these are the letters
+    the neural network was validated on, rather than trained on, including
+    when it was warm started on appended letters.
+
+    :param data: Numpy Array, (N, 20, 20, 1) letters, fed exactly as the
+    solver feeds them (i.e. uint8 in the range [0, 255]).
+    :param labels: Numpy Array, (N,) the label of each letter.
+    :param classes: Numpy Array, the labels in the order of the model outputs.
+    :param perClass: Integer, the largest number of prototypes per label.
+    :param precision: Float, the fraction of answers that must be right.
+    :param iterations: Integer, the number of k-means iterations.
+    :param seed: Integer, the seed of the held-out split and the k-means initialisation.
+    :param heldOut: Float, the fraction of letters held out to calibrate the threshold.
+    :return: PrototypeIndex, the index.
+    """
+    from data import splitIndices
+
+    classes = np.asarray(classes)
+    labels = np.asarray(labels)
+    random = np.random.RandomState(seed)
+    fitIndices, calibrationIndices = splitIndices(len(labels), heldOut, seed)
+    fitIndices = np.sort(fitIndices)
+    calibrationIndices = np.sort(calibrationIndices)
+
+    prototypes = []
+    prototypeClasses = []
+    for c, label in enumerate(classes):
+        indices = fitIndices[labels[fitIndices] == label]
+        letters = np.asarray(data[indices], dtype=np.float32).reshape(-1, PROTOTYPE_PIXELS)
+        if not len(letters):
+            continue
+
+        centres = letters[random.choice(len(letters), min(perClass, len(letters)), replace=False)]
+        for _ in range(iterations):
+            nearest = np.argmin(squaredDistances(letters, centres), axis=1)
+            for k in range(len(centres)):
+                members = letters[nearest == k]
+                if len(members):
+                    centres[k] = members.mean(axis=0)
+        prototypes.append(centres)
+        prototypeClasses += [c] * len(centres)
+
+    index = PrototypeIndex(np.concatenate(prototypes), np.array(prototypeClasses), classes, maxRatio=0.0)
+
+    # Calibrate the threshold: sort the held-out letters from most to least
+    # confident and keep the longest run of answers that is still precise enough
+    predicted, ratios = index.match(data[calibrationIndices])
+    isCorrect = classes[predicted] == labels[calibrationIndices]
+    isCorrect, ratios = isCorrect[np.isfinite(ratios)], ratios[np.isfinite(ratios)]
+    order = np.argsort(ratios, kind="stable")
+    precisions = np.cumsum(isCorrect[order]) / np.arange(1, len(order) + 1)
+    precise = np.nonzero(precisions >= precision)[0]
+    if len(precise):
+        index.maxRatio = float(ratios[order][precise[-1]])
+    return index
+
+
+class PrototypeIndex:
+    """
+    Responsible for classifying letters by their nearest prototype, which
+    is only trusted when the letter is clearly closer to the prototypes of
+    one label than to those of any other.
+    """
+
+    def __init__(self, prototypes, prototypeClasses, classes, maxRatio):
+        """
+        :param prototypes: Numpy Array, (P, 400) the prototype letters.
+        :param prototypeClasses: Numpy Array, (P,) the class index of each prototype.
+        :param classes: Numpy Array, the labels in the order of the model outputs.
+        :param maxRatio: Float, the largest distance ratio (see match) answered.
+        """
+        # Sorted by class, so the prototypes of each class are contiguous
+        order = np.argsort(prototypeClasses, kind="stable")
+        self.prototypes = np.asarray(prototypes, dtype=np.float32)[order]
+        self.prototypeClasses = np.asarray(prototypeClasses, dtype=np.int64)[order]
+        self.classes = np.asarray(classes)
+        self.maxRatio = float(maxRatio)
+        self.presentClasses, self.classStarts = np.unique(self.prototypeClasses, return_index=True)
+
+    @classmethod
+    def load(cls, PATH_PROTOTYPES):
+        """
+        :param PATH_PROTOTYPES: String, path to the index file (.npz).
+        :return: PrototypeIndex, the index.
+        """
+        index = np.load(PATH_PROTOTYPES)
+        return cls(index["prototypes"], index["prototypeClasses"], index["classes"], index["maxRatio"])
+
+    def save(self, PATH_PROTOTYPES):
+        """
+        :param PATH_PROTOTYPES: String, path to the index file (.npz).
+        """
+        np.savez(PATH_PROTOTYPES, prototypes=self.prototypes, prototypeClasses=self.prototypeClasses,
+                 classes=np.asarray(self.classes, dtype=str), maxRatio=np.float32(self.maxRatio))
+
+    def match(self, letters, chunkSize=4096):
+        """
+        Finds the nearest label of every letter along with the ratio of the
+        distance to its nearest prototype over the distance to the nearest
+        prototype of any other label (0 is certain, 1 is a coin toss, and
+        infinity when the index has no other label).
+
+        :param letters: Numpy Array, (N, 20, 20, 1) letters.
+        :param chunkSize: Integer, the number of letters compared at a time (bounds memory).
+        :return: 2-Tuple, (classIndices, ratios)
+        """
+        numberClasses = len(self.classes)
+        predicted = np.empty(len(letters), dtype=np.int64)
+        ratios = np.empty(len(letters), dtype=np.float32)
+
+        for i in range(0, len(letters), chunkSize):
+            chunk = np.asarray(letters[i:i+chunkSize], dtype=np.float32).reshape(-1, PROTOTYPE_PIXELS)
+            distances = squaredDistances(chunk, self.prototypes)
+
+            # Nearest prototype of each label, then the two nearest labels
+            perClass = np.full((len(chunk), numberClasses), np.inf, dtype=np.float32)
+            perClass[:, self.presentClasses] = np.minimum.reduceat(distances, self.classStarts, axis=1)
+            nearest = np.argsort(perClass, axis=1)[:, :2]
+            first = np.take_along_axis(perClass, nearest[:, :1], axis=1)[:, 0]
+            second = np.take_along_axis(perClass, nearest[:, 1:2], axis=1)[:, 0]
+
+            # Without a second label (e.g. an index of a single label) there
+            # is nothing to tell the nearest one apart from, so never trust it
+            predicted[i:i+chunkSize] = nearest[:, 0]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratios[i:i+chunkSize] = np.where(np.isinf(second), np.inf,
+                                                 np.where(second > 0, np.sqrt(first / second), 1.0))
+        return predicted, ratios
+
+
+class CascadeModel:
+    """
+    Responsible for classifying letters in tiers: the prototype index
+    answers the letters it is confident about and only the remaining ones
+    are fed to the neural network. It predicts like the model it wraps, so
+    it can be used in its place.
+
+    The hit rate and time spent of each tier are kept in tiers.
+    """
+
+    def __init__(self, index, model):
+        """
+        :param index: PrototypeIndex, the first tier (with the classes of the model).
+        :param model: The neural network model, the second tier.
+        """
+        self.index = index
+        self.model = model
+        self.tiers = {name: {"letters": 0, "hits": 0, "seconds": 0.0} for name in ("prototypes", "model")}
+
+    def predict(self, x, batch_size=None):
+        """
+        :param x: Numpy Array, (N, 20, 20, 1) letter images.
+        :param batch_size: Integer, optional number of letters per pass of the model.
+        :return: Numpy Array, (N, numberLabels) probabilities (for letters
+        answered by the prototypes, 1 - ratio of the matched label).
+        """
+        timeStart = time.perf_counter()
+        with instrument.span("predict.prototypes"):
+            predicted, ratios = self.index.match(x)
+            isHit = ratios <= self.index.maxRatio
+        probabilities = np.zeros((len(x), len(self.index.classes)), dtype=np.float32)
+        hits = np.nonzero(isHit)[0]
+        probabilities[hits, predicted[hits]] = 1 - ratios[hits]
+        self._record("prototypes", len(x), len(hits), time.perf_counter() - timeStart)
+
+        misses = np.nonzero(~isHit)[0]
+        if len(misses):
+            timeStart = time.perf_counter()
+            with instrument.span("predict.model"):
+                probabilities[misses] = self.model.predict(x[misses], batch_size=batch_size)
+            self._record("model", len(misses), len(misses), time.perf_counter() - timeStart)
+        return probabilities
+
+    def report(self):
+        """
+        :return: Dictionary, the hit rate and latency of each tier.
+        """
+        report = {}
+        for name, tier in self.tiers.items():
+            report[name] = dict(tier)
+            report[name]["hitRate"] = tier["hits"] / tier["letters"] if tier["letters"] else 0.0
+            report[name]["microsecondsPerLetter"] = tier["seconds"] / tier["letters"] * 1e6 if tier["letters"] else 0.0
+        return report
+
+    def _record(self, name, letters, hits, seconds):
+        tier = self.tiers[name]
+        tier["letters"] += letters
+        tier["hits"] += hits
+        tier["seconds"] += seconds
+        instrument.count(f"predict.{name}.hits", hits)
+
+
+def squaredDistances(x, y):
+    """
+    :param x: Numpy Array, (N, features) float32.
+    :param y: Numpy Array, (M, features) float32.
+    :return: Numpy Array, (N, M) the squared euclidean distance of every pair.
+    """
+    distances = (x * x).sum(axis=1)[:, np.newaxis] - 2 * (x @ y.T)
+    distances += (y * y).sum(axis=1)
+    np.maximum(distances, 0, out=distances)
+    return distances
+
+
+def windows(x, size, strides):
+    """
+    Views every (valid) window of a batch of images without copying.
+
+    :param x: Numpy Array, (N, H, W, C) images.
+    :param size: 2-Tuple, (height, width) of the windows.
+    :param strides: 2-Tuple, (vertical, horizontal) step between windows.
+    :return: Numpy Array, (N, H', W', C, height, width) view of the windows.
+    """
+    n, h, w, c = x.shape
+    sn, sh, sw, sc = x.strides
+    outH = (h - size[0]) // strides[0] + 1
+    outW = (w - size[1]) // strides[1] + 1
+    return as_strided(x, shape=(n, outH, outW, c, size[0], size[1]),
+                      strides=(sn, sh * strides[0], sw * strides[1], sc, sh, sw),
+                      writeable=False)
+
+
+def softmax(x):
+    """
+    :param x: Numpy Array, (N, K) logits.
+    :return: Numpy Array, (N, K) probabilities.
+    """
+    x = x - x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+
+def compareModels(PATH_MODELS, PATH_DATA, batchSize=256):
+    """
+    Solves every captcha in a directory with each model and reports their
+    accuracy, the accuracy lost relative to the first model, their size on
+    disk and in memory, their speed and the latency of the model alone.
+
+    :param PATH_MODELS: List, paths to the weights files (.npz) to compare.
+    :param PATH_DATA: String, path to the directory of <NUM>_<LABEL>.jpg captchas.
+    :param batchSize: Integer, number of captchas solved at once.
+    :return: Dictionary, mapping each model path to its measurements.
+    """
+    from data import ImageHandler
+    from filter import ImageFilter
+    from results import SolveResults
+    from solver import Solver
+
+    imageHandler = ImageHandler(os.path.dirname(os.path.abspath(PATH_DATA)))
+    dataset = os.path.basename(os.path.abspath(PATH_DATA))
+    with imageHandler:
+        captchas = imageHandler.readMany(sorted(imageHandler.index(dataset)), dataset)
+    images = [img for img, _, _ in captchas]
+    imageIds = [int(num) for _, _, num in captchas]
+    solutions = [solution for _, solution, _ in captchas]
+
+    solver = Solver()
+    imageFilter = ImageFilter()
+    results = {}
+    for PATH_MODEL in PATH_MODELS:
+        model, labeller = solver.loadModel(PATH_MODEL)
+        residentBytes = model.residentBytes()
+        model = TimedModel(model)
+        timeStart = time.perf_counter()
+        solved = SolveResults.concatenate([
+            solver.predictBatch(images[i:i+batchSize], model, labeller, imageFilter, batchSize,
+                                imageIds[i:i+batchSize], solutions[i:i+batchSize])
+            for i in range(0, len(images), batchSize)])
+        elapsed = time.perf_counter() - timeStart
+
+        results[PATH_MODEL] = {
+            "captchaAccuracy": solved.correct().mean() * 100,
+            "letterAccuracy": solved.letterCorrect().mean() * 100,
+            "captchasPerSecond": len(images) / elapsed,
+            "microsecondsPerLetter": model.seconds / model.letters * 1e6 if model.letters else 0.0,
+            "sizeBytes": os.path.getsize(PATH_MODEL),
+            "residentBytes": residentBytes,
+        }
+
+    reference = results[PATH_MODELS[0]]
+    for PATH_MODEL, result in results.items():
+        result["captchaAccuracyDelta"] = result["captchaAccuracy"] - reference["captchaAccuracy"]
+        result["latencyRatio"] = (result["microsecondsPerLetter"] / reference["microsecondsPerLetter"]
+                                  if reference["microsecondsPerLetter"] else 1.0)
+        print(f"{PATH_MODEL}: accuracy {result['captchaAccuracy']:.2f}% "
+              f"({result['captchaAccuracyDelta']:+.2f}%), letters {result['letterAccuracy']:.2f}%, "
+              f"{result['microsecondsPerLetter']:.1f}us/letter (x{result['latencyRatio']:.2f}), "
+              f"{result['captchasPerSecond']:.1f} captchas/second, {result['sizeBytes'] / 2**20:.2f}MiB on disk, "
+              f"{result['residentBytes'] / 2**20:.2f}MiB in memory")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NumPy runtime of the letter classifier.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    quantize = commands.add_parser("quantize", help="quantize an exported model to int8")
+    quantize.add_argument("weights", help="exported weights file (.npz)")
+    quantize.add_argument("letters", help="packed letter dataset used for calibration")
+    quantize.add_argument("out", help="quantized weights file (.npz)")
+
+    compare = commands.add_parser("compare", help="compare the accuracy and latency of exported models")
+    compare.add_argument("models", nargs="+", help="weights files (.npz), the first is the reference")
+    compare.add_argument("data", help="directory of <NUM>_<LABEL>.jpg captchas")
+
+    prototypes = commands.add_parser("prototypes", help="build the letter prototypes of a cascade")
+    prototypes.add_argument("weights", help="exported weights file (.npz) whose labels to use")
+    prototypes.add_argument("letters", help="packed letter dataset")
+    prototypes.add_argument("out", help="prototypes file (.npz)")
+    args = parser.parse_args()
+
+    if args.command == "quantize":
+        from data import readPackedLetters
+        quantizeModel(args.weights, args.out, readPackedLetters(args.letters)[0])
+    elif args.command == "prototypes":
+        from data import readPackedLetters
+        data, labels = readPackedLetters(args.letters)
+        buildPrototypes(data, labels, loadRuntime(args.weights)[1].classes_).save(args.out)
+    else:
+        compareModels(args.models, args.data)
+
+
+if __name__ == "__main__":
+    main()
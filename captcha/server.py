@@ -0,0 +1,273 @@
+"""
+Long-running solver service that keeps the neural network loaded and solves
+captchas sent to it over a local HTTP endpoint.
+
+Usage:
+    python server.py --port 8080
+
+    curl --data-binary @000001_00YQ.jpg http://127.0.0.1:8080/solve
+    {"captcha": "00YQ", "latency": 0.0123}
+"""
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from filter import ImageFilter
+from solver import BATCH_SIZE, ENGINE_CAPTCHA, ENGINE_LETTERS, ENGINES, Solver
+
+
+class SolveRequest:
+    """
+    Responsible for carrying a single captcha to the batching thread and
+    its answer back.
+    """
+
+    def __init__(self, img):
+        """
+        :param img: cv2.Image, the image of the captcha.
+        """
+        self.img = img
+        self.timeStart = time.perf_counter()
+        self.done = threading.Event()
+        self.captcha = None
+        self.error = None
+
+
+class SolverService:
+    """
+    Responsible for keeping the neural network loaded and solving the
+    captchas of concurrent requests together in micro-batches.
+
+    The model is loaded and used by a single batching thread only, since
+    Keras models are not meant to be shared between threads.
+    """
+
+    def __init__(self, PATH_MODEL, PATH_LABEL, batchSize=BATCH_SIZE, maxDelay=0.005, segmentationCache=None,
+                 engine=ENGINE_LETTERS):
+        """
+        :param PATH_MODEL: String, path to the trained model file (.hdf5 or .npz).
+        :param PATH_LABEL: String, path to the labels file (Keras models only).
+        :param batchSize: Integer, the largest number of captchas solved at once.
+        :param maxDelay: Float, seconds to wait for more requests to fill a batch.
+        :param segmentationCache: SegmentationCache, optional cache consulted
+        before detecting letters.
+        :param engine: String, the engine solving the captchas (see solver.ENGINES).
+        """
+        self.PATH_MODEL = PATH_MODEL
+        self.PATH_LABEL = PATH_LABEL
+        self.batchSize = batchSize
+        self.maxDelay = maxDelay
+        self.solver = Solver(engine)
+        self.imageFilter = ImageFilter(segmentationCache)
+        self.requests = queue.Queue()
+        self.ready = threading.Event()
+        self.loadError = None
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        """
+        Starts the batching thread and waits until the model is loaded.
+        """
+        self.thread.start()
+        self.ready.wait()
+        if self.loadError:
+            raise self.loadError
+
+    def stop(self):
+        """
+        Stops the batching thread once the pending requests are solved.
+        """
+        self.requests.put(None)
+        self.thread.join()
+
+    def solve(self, imageBytes):
+        """
+        Solves a captcha.
+
+        :param imageBytes: Bytes, the encoded image of the captcha (e.g. JPEG).
+        :return: 2-Tuple, (solvedCaptchaAsString, latencyInSeconds)
+        """
+        img = cv2.imdecode(np.frombuffer(imageBytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("Could not decode the image")
+        if img.shape != (20, 60, 3):
+            raise ValueError(f"Expected a 60x20 captcha, got {img.shape[1]}x{img.shape[0]}")
+
+        request = SolveRequest(img)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error:
+            raise request.error
+        return request.captcha, time.perf_counter() - request.timeStart
+
+    def _loop(self):
+        """
+        Batching thread: loads the model, then solves requests in batches of
+        whatever arrived within the maximum delay (up to the batch size).
+        """
+        try:
+            model, labeller = self.solver.loadModel(self.PATH_MODEL, self.PATH_LABEL)
+        except Exception as e:
+            self.loadError = e
+            return
+        finally:
+            self.ready.set()
+
+        isRunning = True
+        while isRunning:
+            batch = []
+            request = self.requests.get()
+            deadline = time.perf_counter() + self.maxDelay
+            while True:
+                if request is None:
+                    isRunning = False
+                    break
+                batch.append(request)
+                timeLeft = deadline - time.perf_counter()
+                if len(batch) >= self.batchSize or timeLeft <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeLeft)
+                except queue.Empty:
+                    break
+
+            if not batch:
+                continue
+
+            try:
+                images = [request.img for request in batch]
+                solved = self.solver.solveBatch(images, model, labeller, self.imageFilter, self.batchSize)
+                for request, (captcha, _) in zip(batch, solved):
+                    request.captcha = captcha
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            finally:
+                for request in batch:
+                    request.done.set()
+
+
+class SolverRequestHandler(BaseHTTPRequestHandler):
+    """
+    Responsible for the HTTP endpoints of the solver service:
+
+        POST /solve     body is the encoded captcha image
+        GET  /health
+    """
+
+    def do_POST(self):
+        if self.path != "/solve":
+            self._reply(404, {"error": "Not found"})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            captcha, latency = self.server.service.solve(self.rfile.read(length))
+        except ValueError as e:
+            self._reply(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._reply(500, {"error": str(e)})
+            return
+        self._reply(200, {"captcha": captcha, "latency": latency})
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"status": "ok"})
+        else:
+            self._reply(404, {"error": "Not found"})
+
+    def log_message(self, format, *args):
+        # Logging every request to stderr costs more than solving it
+        pass
+
+    def _reply(self, status, body):
+        """
+        :param status: Integer, the HTTP status code.
+        :param body: Dictionary, sent as JSON.
+        """
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(service, host="127.0.0.1", port=8080):
+    """
+    Creates an HTTP server in front of a started solver service. The caller
+    is responsible for calling serve_forever() (and shutdown()) on it.
+
+    :param service: SolverService, the started solver service.
+    :param host: String, the address to listen on (local only by default).
+    :param port: Integer, the port to listen on (0 picks a free one).
+    :return: ThreadingHTTPServer, the server.
+    """
+    httpServer = ThreadingHTTPServer((host, port), SolverRequestHandler)
+    httpServer.daemon_threads = True
+    httpServer.service = service
+    return httpServer
+
+
+def requestSolve(imageBytes, host="127.0.0.1", port=8080, timeout=10):
+    """
+    Asks a running solver service to solve a captcha.
+
+    :param imageBytes: Bytes, the encoded image of the captcha (e.g. JPEG).
+    :param host: String, the address of the service.
+    :param port: Integer, the port of the service.
+    :param timeout: Float, seconds to wait for the answer.
+    :return: Dictionary, containing the captcha and latency.
+    """
+    request = urllib.request.Request(f"http://{host}:{port}/solve", data=imageBytes, method="POST")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def main():
+    PATH_OUT = os.path.join("..", "data", "output")
+
+    parser = argparse.ArgumentParser(description="Serves the captcha solver over local HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", help="Keras (.hdf5) or NumPy (.npz) model (defaults to the model of the engine)")
+    parser.add_argument("--labels", help="labels of a Keras model (defaults to the labels of the engine)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--max-delay", type=float, default=0.005, help="seconds to wait to fill a batch")
+    parser.add_argument("--engine", choices=ENGINES, default=ENGINE_LETTERS)
+    args = parser.parse_args()
+
+    # Same defaults as solving from main.py
+    if args.engine == ENGINE_CAPTCHA:
+        args.model = args.model or os.path.join(PATH_OUT, "captcha_model.hdf5")
+        args.labels = args.labels or os.path.join(PATH_OUT, "captcha_labels.dat")
+    else:
+        PATH_WEIGHTS = os.path.join(PATH_OUT, "model.npz")
+        args.model = args.model or (PATH_WEIGHTS if os.path.isfile(PATH_WEIGHTS) else os.path.join(PATH_OUT, "model.hdf5"))
+        args.labels = args.labels or os.path.join(PATH_OUT, "labels.dat")
+
+    service = SolverService(args.model, args.labels, args.batch_size, args.max_delay, engine=args.engine)
+    service.start()
+    httpServer = serve(service, args.host, args.port)
+    print(f"Solver listening on http://{args.host}:{httpServer.server_port}/solve")
+    try:
+        httpServer.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpServer.server_close()
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,43 @@
-import glob
 import os
 import pickle
 
 import cv2
 import numpy as np
-from keras.models import load_model
 
+import instrument
 from data import ImageHandler
 from data import resizeToFit
-from filter import ImageFilter
+from filter import FALLBACK_REGIONS, ImageFilter
+from pipeline import SolvePipeline
+from results import SolveResults
+from runtime import CascadeModel, PrototypeIndex, loadRuntime
+from writer import OutputWriter
 
 
 GREEN = (0, 255, 0)
+BATCH_SIZE = 64     # Number of captchas fed to the neural network at once
+
+# Engines of the solver: one letter at a time after detecting the letters
+# (NeuralNetwork), or the whole captcha in one go (CaptchaNetwork)
+ENGINE_LETTERS = "letters"
+ENGINE_CAPTCHA = "captcha"
+ENGINES = (ENGINE_LETTERS, ENGINE_CAPTCHA)
 
 
 class Solver:
 
+    def __init__(self, engine=ENGINE_LETTERS, PATH_PROTOTYPES=None):
+        """
+        :param engine: String, the engine solving the captchas (see ENGINES).
+        :param PATH_PROTOTYPES: String, optional letter prototypes (.npz, see
+        runtime.buildPrototypes) tried before the neural network of the
+        letters engine (see runtime.CascadeModel).
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+        self.engine = engine
+        self.PATH_PROTOTYPES = PATH_PROTOTYPES
+
     def solveLetter(self, img, model, labeller):
         """
         Predicts the letter contained in the image by feeding the image
@@ -47,74 +69,295 @@ class Solver:
         :param labeller: sklearn.preprocessing.label.LabelBinarizer, contains labels.
         :return: 2-Tuple, (solvedCaptchaAsString, solvedCaptchaAsImage).
         """
-        grayscale = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        letterRegions = imageFilter.computeLetterDetectionAlgorithm(img)
+        return self.solveBatch([img], model, labeller, imageFilter)[0]
+
+    def solveBatch(self, images, model, labeller, imageFilter, batchSize=BATCH_SIZE):
+        """
+        Attempts to solve a list of captchas via a neural network.
+
+        Every letter of every captcha is stacked into a single tensor so that
+        the neural network is only called once per batch of letters, rather
+        than once per letter.
+
+        :param images: List, containing cv2.Image captchas.
+        :param model: keras.engine.sequential.Sequential, the neural network model.
+        :param labeller: sklearn.preprocessing.label.LabelBinarizer, contains labels.
+        :param imageFilter: ImageFilter, used to detect the letters.
+        :param batchSize: Integer, number of captchas fed to the network at once.
+        :return: List of 2-Tuples, (solvedCaptchaAsString, solvedCaptchaAsImage).
+        """
+        if not images:
+            return []
+        results = self.predictBatch(images, model, labeller, imageFilter, batchSize)
+        return list(zip(results.captchas().tolist(), self.drawResults(images, results)))
+
+    def predictBatch(self, images, model, labeller, imageFilter, batchSize=BATCH_SIZE,
+                     imageIds=None, solutions=None):
+        """
+        Predicts the letters of a list of captchas via a neural network, like
+        solveBatch, but keeps the predictions as array records rather than
+        drawing them.
+
+        :param images: List, containing cv2.Image captchas.
+        :param model: keras.engine.sequential.Sequential, the neural network model.
+        :param labeller: sklearn.preprocessing.label.LabelBinarizer, contains labels.
+        :param imageFilter: ImageFilter, used to detect the letters.
+        :param batchSize: Integer, number of captchas fed to the network at once.
+        :param imageIds: List, optional number of each captcha image.
+        :param solutions: List, optional expected solution of each captcha.
+        :return: SolveResults, the predictions.
+        """
+        if len(images) == 0:
+            return SolveResults(np.empty(0), np.empty((0, 4, 4)), np.empty((0, 4)), np.empty((0, 4)),
+                                labeller.classes_)
+        if self.engine == ENGINE_CAPTCHA:
+            return self._predictCaptchaBatch(images, model, labeller, batchSize, imageIds, solutions)
+
+        # Detect the letters of every captcha first (always 4 per captcha)
+        images = np.stack(images)
+        letterRegions = imageFilter.computeLetterDetectionBatch(images)
+
+        # Re-size every letter to 20x20 pixels (to match training data) and
+        # stack them into one contiguous 4d tensor to make Keras happy
+        letters = np.empty((letterRegions.shape[0]*letterRegions.shape[1], 20, 20, 1), dtype=np.uint8)
+        i = 0
+        with instrument.span("resize"):
+            for img, regions in zip(images, letterRegions.tolist()):
+                grayscale = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+                for (x0, y0, x1, y1) in regions:
+                    resizeToFit(grayscale[y0:y1, x0:x1], 20, 20, out=letters[i])
+                    i += 1
+
+        # Ask the neural network to predict all letters in one go, keeping
+        # the most likely class of each letter and its probability
+        with instrument.span("predict"):
+            predictions = model.predict(letters, batch_size=batchSize*letterRegions.shape[1])
+            letterClasses = np.argmax(predictions, axis=1)
+            confidences = predictions[np.arange(len(predictions)), letterClasses]
+        instrument.count("predict.letters", len(letters))
+        instrument.count("solve.captchas", len(images))
+
+        if imageIds is None:
+            imageIds = np.zeros(len(images), dtype=np.int64)
+        shape = letterRegions.shape[:2]
+        return SolveResults(imageIds, letterRegions, letterClasses.reshape(shape), confidences.reshape(shape),
+                            labeller.classes_, solutions)
+
+    def _predictCaptchaBatch(self, images, model, labeller, batchSize, imageIds=None, solutions=None):
+        """
+        Same as predictBatch, but feeding the whole captchas to a network
+        that predicts every letter at once (see CaptchaNetwork). As no letters
+        are detected, the fixed fallback regions stand in for them.
+        """
+        # Unlike the letter engine, this network is fed the same [0, 1]
+        # range it was trained on
+        with instrument.span("resize"):
+            grayscale = np.stack([cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) for img in images])
+            captchas = grayscale[..., np.newaxis].astype(np.float32) / 255.0
 
-        # Preparing to draw output on an image
-        predictions = []
+        with instrument.span("predict"):
+            predictions = np.stack(model.predict(captchas, batch_size=batchSize), axis=1)
+            letterClasses = np.argmax(predictions, axis=2)
+            confidences = np.take_along_axis(predictions, letterClasses[..., np.newaxis], axis=2)[..., 0]
+        instrument.count("predict.captchas", len(images))
+        instrument.count("solve.captchas", len(images))
+
+        if imageIds is None:
+            imageIds = np.zeros(len(images), dtype=np.int64)
+        letterRegions = np.broadcast_to(np.array(FALLBACK_REGIONS), (len(images), 4, 4))
+        return SolveResults(imageIds, letterRegions, letterClasses, confidences, labeller.classes_, solutions)
+
+    def drawResults(self, images, results):
+        """
+        :param images: List, containing cv2.Image captchas.
+        :param results: SolveResults, the predictions for the captchas.
+        :return: List, containing the captchas with the predictions drawn above them.
+        """
+        return [self._drawPredictions(img, regions, captcha)
+                for img, regions, captcha in zip(images, results.letterRegions.tolist(), results.captchas())]
+
+    def _drawPredictions(self, img, letterRegions, predictions):
+        """
+        Draws the letter regions and predicted letters onto a copy of the
+        captcha.
+
+        :param img: cv2.Image, the image of the captcha.
+        :param letterRegions: List, containing coordinates of individual letters.
+        :param predictions: List, containing the predicted letters.
+        :return: cv2.Image, the captcha with the predictions drawn above it.
+        """
         OFFSET = 20
         outImage = cv2.copyMakeBorder(img, OFFSET, 0, 0, 0, cv2.BORDER_CONSTANT)
 
-        # Solving for each letter in captcha
-        for (x0, y0, x1, y1) in letterRegions:
-            letter = self.solveLetter(grayscale[y0:y1, x0:x1], model, labeller)
-            predictions.append(letter)
-
-            # draw the prediction on the output image
+        for (x0, y0, x1, y1), letter in zip(letterRegions, predictions):
             cv2.rectangle(outImage, (x0, y0+OFFSET), (x1, y1+OFFSET), GREEN, 1)
             cv2.putText(outImage, letter, (x0, y0+15), cv2.FONT_HERSHEY_SIMPLEX, 0.55, GREEN, 1)
+        return outImage
 
-        captcha = ''.join(predictions)
-        return captcha, outImage
-
-    def analyseResults(self, results):
+    def analyseResults(self, results, verbose=False):
         """
         Analyses the results of the neural network to give meaningful metrics.
 
-        :param results: Dictionary, mapping expected value to predicted.
+        :param results: SolveResults, the predictions and expected solutions.
+        :param verbose: Boolean, whether to print every misclassification.
         """
         total = len(results)
-        correct = 0
+        isCorrect = results.correct()
+        correct = int(isCorrect.sum())
 
-        for expected, predicted in results.items():
-            if expected == predicted:
-                correct += 1
-            else:
-                print(f"Misclassification: {predicted} != {expected}")
+        if verbose:
+            wrong = ~isCorrect
+            for imageId, predicted, expected in zip(results.imageIds[wrong], results.captchas()[wrong],
+                                                    results.solutions[wrong]):
+                print(f"Misclassification: {predicted} != {expected} (image {imageId:06d})")
+        instrument.count("solve.misclassified", total - correct)
 
         print("Total: ", total)
         print("Incorrect: ", total - correct)
         print("Accuracy: ", correct/total * 100)
+        print("Letter accuracy: ", results.letterCorrect().mean() * 100)
 
-    def run(self, PATH_DATA, PATH_MODEL, PATH_LABEL):
+    def run(self, PATH_DATA, PATH_MODEL, PATH_LABEL, batchSize=BATCH_SIZE, segmentationCache=None,
+            outputWriter=None):
         """
         Runs the solver against the given data directory
 
         :param PATH_DATA: String, path to the data containing letter images.
         :param PATH_MODEL: String, path to the output model file.
         :param PATH_LABEL: String, path to the output labels file.
+        :param batchSize: Integer, number of captchas solved at once.
+        :param segmentationCache: SegmentationCache, optional cache consulted
+        before detecting letters.
+        :param outputWriter: OutputWriter, writes the solved captchas in the
+        background (defaults to JPEGs with linked category views).
+        """
+        results = []
+        imageFilter = ImageFilter(segmentationCache)
+        imageHandler = ImageHandler(os.path.join(PATH_DATA, ".."))
+        outputWriter = outputWriter or OutputWriter(imageHandler.PATH_DATA)
+        numberImages = imageHandler.count("validation")
+        model, labeller = self.loadModel(PATH_MODEL, PATH_LABEL)
+
+        # Solve captchas in batches and save output
+        with outputWriter, imageHandler:
+            for batchStart in range(1, numberImages+1, batchSize):
+                batchEnd = min(batchStart + batchSize, numberImages+1)
+                batch = imageHandler.readMany(range(batchStart, batchEnd), "validation")
+                images = [img for img, _, _ in batch]
+                imageIds = [int(num) for _, _, num in batch]
+                solutions = [solution for _, solution, _ in batch]
+                batchResults = self.predictBatch(images, model, labeller, imageFilter, batchSize,
+                                                 imageIds, solutions)
+                results.append(batchResults)
+
+                # Pure scoring runs skip drawing as well as writing
+                if outputWriter.codec == "none":
+                    continue
+                outImages = self.drawResults(images, batchResults)
+                for (_, solution, num), captcha, outImage in zip(batch, batchResults.captchas(), outImages):
+                    self._writeSolved(outputWriter.write, outImage, solution, num, captcha)
+
+        self.analyseResults(SolveResults.concatenate(results))
+        self.printTiers(model)
+
+    def runStreaming(self, PATH_DATA, PATH_MODEL, PATH_LABEL, batchSize=BATCH_SIZE,
+                     segmentationCache=None, readers=2, writers=2, outputWriter=None):
+        """
+        Same as run, but reading, solving and writing happen at the same
+        time in a pipeline (see SolvePipeline), reporting the throughput of
+        each stage.
+
+        :param PATH_DATA: String, path to the data containing letter images.
+        :param PATH_MODEL: String, path to the output model file.
+        :param PATH_LABEL: String, path to the output labels file.
+        :param batchSize: Integer, largest number of captchas solved at once.
+        :param segmentationCache: SegmentationCache, optional cache consulted
+        before detecting letters.
+        :param readers: Integer, the number of threads reading images.
+        :param writers: Integer, the number of threads writing images.
+        :param outputWriter: OutputWriter, encodes and writes the solved
+        captchas (on the writer threads of the pipeline).
+        :return: Dictionary, the throughput measurements of each stage.
         """
-        results = {}
-        imageFilter = ImageFilter()
+        imageFilter = ImageFilter(segmentationCache)
         imageHandler = ImageHandler(os.path.join(PATH_DATA, ".."))
-        numberImages = len(glob.glob(f"{PATH_DATA}/*"))
-
-        # Loading trained model
-        with open(PATH_LABEL, "rb") as f:
-            labeller = pickle.load(f)
-        model = load_model(PATH_MODEL)
-
-        # Solve captchas and save output
-        for i in range(1, numberImages+1):
-            img, solution, num = imageHandler.read(i, "validation")
-            captcha, outImage = self.solveCaptcha(img, model, labeller, imageFilter)
-            results[solution] = captcha
-
-            if captcha == solution:
-                classify = "output/solved_correct"
-            else:
-                classify = "output/solved_incorrect"
-            imageHandler.write(outImage, solution, num, classify)
-            imageHandler.write(outImage, solution, num, "output/solved")
+        outputWriter = outputWriter or OutputWriter(imageHandler.PATH_DATA)
+        imageNums = sorted(imageHandler.index("validation"))
+        model, labeller = self.loadModel(PATH_MODEL, PATH_LABEL)
+
+        def writeSolved(outImage, solution, num, captcha):
+            self._writeSolved(outputWriter.writeNow, outImage, solution, num, captcha)
+
+        # Pure scoring runs skip drawing as well as writing (as in run)
+        write = writeSolved if outputWriter.codec != "none" else None
 
+        pipeline = SolvePipeline(self, model, labeller, imageFilter, imageHandler,
+                                 batchSize, readers, writers)
+        with outputWriter, imageHandler:
+            results, stats = pipeline.run(imageNums, "validation", write)
+
+        for name in ("read", "solve", "write"):
+            print(f"Stage '{name}': {stats[name]['itemsPerBusySecond']:.2f} images/second (when busy)")
+        print(f"Overall: {stats['total']['itemsPerSecond']:.2f} images/second")
         self.analyseResults(results)
+        self.printTiers(model)
+        return stats
+
+    def loadModel(self, PATH_MODEL, PATH_LABEL=None):
+        """
+        Loads a trained model and its labels.
+
+        A weights file exported for the NumPy runtime (.npz) already contains
+        the labels and is loaded without importing Keras at all.
+
+        :param PATH_MODEL: String, path to the model file.
+        :param PATH_LABEL: String, path to the labels file (Keras models only).
+        :return: 2-Tuple, (model, labeller)
+        """
+        if PATH_MODEL.endswith(".npz"):
+            if self.engine != ENGINE_LETTERS:
+                raise ValueError("The NumPy runtime only supports the letters engine")
+            model, labeller = loadRuntime(PATH_MODEL)
+        else:
+            from keras.models import load_model
+
+            with open(PATH_LABEL, "rb") as f:
+                labeller = pickle.load(f)
+            model = load_model(PATH_MODEL)
+
+        if self.PATH_PROTOTYPES and self.engine == ENGINE_LETTERS:
+            index = PrototypeIndex.load(self.PATH_PROTOTYPES)
+            if not np.array_equal(index.classes, labeller.classes_):
+                raise ValueError("The letter prototypes were built for the labels of another model")
+            model = CascadeModel(index, model)
+        return model, labeller
+
+    def printTiers(self, model):
+        """
+        Prints the hit rate and latency of each tier of a cascade model.
+
+        :param model: The model returned by loadModel.
+        """
+        if not isinstance(model, CascadeModel):
+            return
+        for name, tier in model.report().items():
+            print(f"Tier '{name}': {tier['hitRate'] * 100:.2f}% of {tier['letters']} letters answered, "
+                  f"{tier['microsecondsPerLetter']:.1f}us/letter")
+
+    def _writeSolved(self, write, outImage, solution, num, captcha):
+        """
+        Saves a solved captcha with all solved captchas, where it also
+        appears among the correctly or incorrectly solved ones (and no longer
+        among the other ones, e.g. after a previous run).
+
+        :param write: Function, either OutputWriter.write or OutputWriter.writeNow.
+        :param outImage: cv2.Image, the captcha with the predictions drawn on it.
+        :param solution: String, the expected solution of the captcha.
+        :param num: String, the number of the image.
+        :param captcha: String, the predicted solution of the captcha.
+        """
+        if captcha == solution:
+            classify, stale = "output/solved_correct", "output/solved_incorrect"
+        else:
+            classify, stale = "output/solved_incorrect", "output/solved_correct"
+        write(outImage, solution, num, "output/solved", [classify], [stale])
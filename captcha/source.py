@@ -0,0 +1,218 @@
+"""
+Module that contains the sources of images: directories and archives (zip
+or tar), which are interchangeable.
+
+Archives are read in place, without extracting them: the members are
+indexed in memory when the archive is opened, then read on demand and
+decoded straight from their bytes.
+"""
+
+import abc
+import fnmatch
+import glob
+import io
+import os
+import tarfile
+import threading
+import zipfile
+
+import cv2
+import numpy as np
+
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def isArchive(PATH):
+    """
+    :param PATH: String, path to a file or directory.
+    :return: Boolean, whether the path is an archive file.
+    """
+    return PATH.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(PATH)
+
+
+def openSource(PATH):
+    """
+    :param PATH: String, path to a directory or an archive.
+    :return: The source of the images at the path.
+    """
+    if not isArchive(PATH):
+        return DirectorySource(PATH)
+    if PATH.lower().endswith(".zip"):
+        return ZipSource(PATH)
+    return TarSource(PATH)
+
+
+def decodeImage(data, flags=cv2.IMREAD_COLOR):
+    """
+    :param data: Bytes, the encoded image (or a .npy file).
+    :param flags: Integer, the OpenCV imread flags.
+    :return: cv2.Image, the decoded image (None if it can't be decoded).
+    """
+    if data[:6] == b"\x93NUMPY":
+        return np.load(io.BytesIO(data))
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+
+class DirectorySource:
+    """
+    Responsible for reading the images of a directory.
+    """
+
+    def __init__(self, PATH_DIR):
+        """
+        :param PATH_DIR: String, path to the directory.
+        """
+        self.PATH = PATH_DIR
+
+    def names(self):
+        """
+        :return: List, the names of the files directly in the directory.
+        """
+        return [entry.name for entry in os.scandir(self.PATH) if entry.is_file()]
+
+    def glob(self, pattern):
+        """
+        :param pattern: String, a glob pattern relative to the directory (e.g. "*/*.jpg").
+        :return: List, the relative names of the matching files.
+        """
+        return [os.path.relpath(PATH_FILE, self.PATH) for PATH_FILE in glob.glob(os.path.join(self.PATH, pattern))]
+
+    def path(self, name):
+        """
+        :param name: String, the name of a file in the source.
+        :return: String, the path of the file (which readImage accepts).
+        """
+        return os.path.join(self.PATH, name)
+
+    def readImage(self, PATH_IMAGE, flags=cv2.IMREAD_COLOR):
+        """
+        :param PATH_IMAGE: String, the path of an image in the source.
+        :param flags: Integer, the OpenCV imread flags.
+        :return: cv2.Image, the image (None if it can't be read).
+        """
+        if PATH_IMAGE.endswith(".npy"):
+            return np.load(PATH_IMAGE)  # Written by OutputWriter in raw mode
+        return cv2.imread(PATH_IMAGE, flags)
+
+    def close(self):
+        pass
+
+
+class ArchiveSource(abc.ABC):
+    """
+    Responsible for reading the images of an archive from an in-memory
+    index of its members. Members can be read by several threads at once,
+    only the reading of their bytes takes turns (decoding doesn't).
+    """
+
+    def __init__(self, PATH_ARCHIVE):
+        """
+        :param PATH_ARCHIVE: String, path to the archive.
+        """
+        self.PATH = PATH_ARCHIVE
+        self.lock = threading.Lock()
+        self.members = self._indexMembers()
+
+    def names(self):
+        """
+        :return: List, the names of every file in the archive.
+        """
+        return list(self.members)
+
+    def glob(self, pattern):
+        """
+        :param pattern: String, a glob pattern relative to the archive (e.g. "*/*.jpg").
+        :return: List, the names of the matching files.
+        """
+        return fnmatch.filter(self.members, pattern)
+
+    def path(self, name):
+        """
+        :param name: String, the name of a file in the archive.
+        :return: String, the path of the file as if the archive were a
+        directory (which readImage accepts).
+        """
+        return os.path.join(self.PATH, name)
+
+    def readImage(self, PATH_IMAGE, flags=cv2.IMREAD_COLOR):
+        """
+        :param PATH_IMAGE: String, the path of an image in the source.
+        :param flags: Integer, the OpenCV imread flags.
+        :return: cv2.Image, the image (None if it can't be decoded).
+        """
+        return decodeImage(self.readBytes(os.path.relpath(PATH_IMAGE, self.PATH)), flags)
+
+    def readBytes(self, name):
+        """
+        :param name: String, the name of a file in the archive.
+        :return: Bytes, the content of the file.
+        """
+        member = self.members[name.replace(os.sep, "/")]
+        with self.lock:
+            return self._readMember(member)
+
+    def close(self):
+        """
+        Closes the archive (its members can no longer be read).
+        """
+        with self.lock:
+            self.archive.close()
+
+    @abc.abstractmethod
+    def _indexMembers(self):
+        """
+        Opens the archive and indexes its members.
+
+        :return: Dictionary, mapping the name of each file to its member.
+        """
+
+    @abc.abstractmethod
+    def _readMember(self, member):
+        """
+        :param member: A member of the archive (from _indexMembers).
+        :return: Bytes, the content of the member.
+        """
+
+
+class ZipSource(ArchiveSource):
+    """
+    Responsible for reading the images of a zip archive.
+    """
+
+    def _indexMembers(self):
+        """
+        :return: Dictionary, mapping the name of each file to its zipfile.ZipInfo.
+        """
+        self.archive = zipfile.ZipFile(self.PATH)
+        return {info.filename: info for info in self.archive.infolist() if not info.is_dir()}
+
+    def _readMember(self, member):
+        """
+        :param member: zipfile.ZipInfo, a member of the archive.
+        :return: Bytes, the content of the member.
+        """
+        return self.archive.read(member)
+
+
+class TarSource(ArchiveSource):
+    """
+    Responsible for reading the images of a (possibly compressed) tar archive.
+
+    Random access is only fast for uncompressed tar archives, as compressed
+    ones have to be decompressed up to the member read.
+    """
+
+    def _indexMembers(self):
+        """
+        :return: Dictionary, mapping the name of each file to its tarfile.TarInfo.
+        """
+        self.archive = tarfile.open(self.PATH)
+        return {info.name: info for info in self.archive.getmembers() if info.isfile()}
+
+    def _readMember(self, member):
+        """
+        :param member: tarfile.TarInfo, a member of the archive.
+        :return: Bytes, the content of the member.
+        """
+        return self.archive.extractfile(member).read()
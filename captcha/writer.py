@@ -0,0 +1,259 @@
+"""
+Module that contains the writer of output images.
+"""
+
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import instrument
+
+
+CODECS = ("jpg", "png", "raw", "none")      # "raw" saves the pixels as .npy, "none" skips writing
+QUALITIES = {"jpg": (95, 0, 100), "png": (3, 0, 9)}    # (default, lowest, highest) JPEG quality or PNG compression
+VIEWS = ("link", "index")
+INDEX_FILE = "index.txt"
+
+
+class OutputWriter:
+    """
+    Responsible for writing output images in a pool of background threads.
+
+    Every image is encoded once and written once. An image that also
+    belongs to other directories (e.g. output/solved_correct as well as
+    output/solved) appears in them as a hard link to the same file, or is
+    listed in an index file in each of them, rather than being encoded and
+    written again.
+
+    Images are written to a temporary file that then replaces the previous
+    image of the same name, so the previous image is never modified in
+    place: it may still be linked from a directory it no longer belongs to.
+
+    The writer is used as a context manager, which waits for every image
+    to be written on exit:
+
+        with OutputWriter(PATH_DATA) as writer:
+            writer.write(image, "XL3H", "000395", "output/solved", ["output/solved_correct"],
+                         ["output/solved_incorrect"])
+    """
+
+    def __init__(self, PATH_DATA, codec="jpg", quality=None, views="link", workers=2, pending=256):
+        """
+        :param PATH_DATA: String, path to the root directory containing data.
+        :param codec: String, the format of the images (see CODECS).
+        :param quality: Integer, JPEG quality (0-100) or PNG compression (0-9),
+        defaults to that of the codec (see QUALITIES).
+        :param views: String, how an image appears in its other directories (see VIEWS).
+        :param workers: Integer, the number of threads writing images.
+        :param pending: Integer, the largest number of images waiting to be
+        written (bounds memory when writing is slower than solving).
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec '{codec}', expected one of {CODECS}")
+        if views not in VIEWS:
+            raise ValueError(f"Unknown views '{views}', expected one of {VIEWS}")
+        if codec in QUALITIES:
+            default, lowest, highest = QUALITIES[codec]
+            quality = default if quality is None else quality
+            if not lowest <= quality <= highest:
+                raise ValueError(f"Quality {quality} of codec '{codec}' must be between {lowest} and {highest}")
+
+        self.PATH_DATA = PATH_DATA
+        self.codec = codec
+        self.quality = quality
+        self.views = views
+        self.directories = set()
+        self.indexEntries = {}
+        self.staleEntries = {}
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(pending)
+        self.executor = ThreadPoolExecutor(workers) if codec != "none" else None
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def write(self, image, imageName, imageNum, PATH_DIR, PATH_VIEWS=(), PATH_STALE=()):
+        """
+        Queues an image to be written, blocking only while too many images
+        are already waiting.
+
+        :param image: cv2.Image, the image.
+        :param imageName: String, the name of the image.
+        :param imageNum: String, the number of the image.
+        :param PATH_DIR: String, path relative to the 'data' directory to store the image.
+        :param PATH_VIEWS: List, paths relative to the 'data' directory that
+        the image also belongs to.
+        :param PATH_STALE: List, paths relative to the 'data' directory that
+        the image no longer belongs to (e.g. from a previous run).
+        """
+        if self.executor is None:
+            return
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(self.writeNow, image, imageName, imageNum, PATH_DIR, PATH_VIEWS, PATH_STALE)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        with self.lock:
+            self.futures = [f for f in self.futures if not f.done() or f.exception()]
+            self.futures.append(future)
+
+    def writeNow(self, image, imageName, imageNum, PATH_DIR, PATH_VIEWS=(), PATH_STALE=()):
+        """
+        Same as write, but writes the image on the calling thread.
+
+        :return: String, path to the written image (None if nothing is written).
+        """
+        if self.codec == "none":
+            return None
+
+        fName = f"{imageNum}_{imageName}.{'npy' if self.codec == 'raw' else self.codec}"
+        with instrument.span("encode"):
+            data = self._encode(image)
+
+        PATH_IMAGE = os.path.join(self._directory(PATH_DIR), fName)
+        with instrument.span("write"):
+            PATH_TEMP = f"{PATH_IMAGE}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(PATH_TEMP, "wb") as f:
+                f.write(data)
+            os.replace(PATH_TEMP, PATH_IMAGE)
+            for PATH_VIEW in PATH_VIEWS:
+                self._addToView(PATH_IMAGE, data, fName, PATH_VIEW)
+            for PATH_VIEW in PATH_STALE:
+                self._removeFromView(PATH_IMAGE, fName, PATH_VIEW)
+        return PATH_IMAGE
+
+    def flush(self):
+        """
+        Waits for every image queued so far to be written and updates the
+        index files, leaving the writer open for more images.
+
+        :raises Exception: The first error raised while writing an image.
+        """
+        with self.lock:
+            futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+        self._writeIndices()
+
+    def close(self):
+        """
+        Waits for every queued image to be written and updates the index files.
+
+        :raises Exception: The first error raised while writing an image.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.flush()
+
+    def _writeIndices(self):
+        """
+        Merges the entries added to (or removed from) each index file since
+        the last update with the entries already in it.
+        """
+        with self.lock:
+            added, self.indexEntries = self.indexEntries, {}
+            removed, self.staleEntries = self.staleEntries, {}
+
+        for PATH_VIEW in set(added) | set(removed):
+            PATH_INDEX = os.path.join(PATH_VIEW, INDEX_FILE)
+            try:
+                with open(PATH_INDEX) as f:
+                    entries = set(f.read().splitlines())
+            except FileNotFoundError:
+                if PATH_VIEW not in added:
+                    continue    # Nothing to remove from
+                entries = set()
+            entries = (entries - removed.get(PATH_VIEW, set())) | added.get(PATH_VIEW, set())
+            with open(PATH_INDEX, "w") as f:
+                f.writelines(f"{entry}\n" for entry in sorted(entries))
+
+    def _encode(self, image):
+        """
+        :param image: cv2.Image, the image.
+        :return: Bytes, the encoded image.
+        """
+        if self.codec == "raw":
+            buffer = io.BytesIO()
+            np.save(buffer, image)
+            return buffer.getvalue()
+
+        if self.codec == "png":
+            params = [cv2.IMWRITE_PNG_COMPRESSION, self.quality]
+        else:
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        isEncoded, data = cv2.imencode(f".{self.codec}", image, params)
+        if not isEncoded:
+            raise IOError(f"Could not encode the image as {self.codec}")
+        return data.tobytes()
+
+    def _directory(self, PATH_DIR):
+        """
+        :param PATH_DIR: String, path relative to the 'data' directory.
+        :return: String, the full path to the directory (created the first
+        time it is used).
+        """
+        PATH_DIR = os.path.join(self.PATH_DATA, PATH_DIR)
+        if PATH_DIR not in self.directories:
+            os.makedirs(PATH_DIR, exist_ok=True)
+            with self.lock:
+                self.directories.add(PATH_DIR)
+        return PATH_DIR
+
+    def _addToView(self, PATH_IMAGE, data, fName, PATH_VIEW):
+        """
+        Makes a written image appear in another directory.
+
+        :param PATH_IMAGE: String, path to the written image.
+        :param data: Bytes, the encoded image (written again if it can't be linked).
+        :param fName: String, the file name of the image.
+        :param PATH_VIEW: String, path relative to the 'data' directory.
+        """
+        PATH_VIEW = self._directory(PATH_VIEW)
+        if self.views == "index":
+            entry = os.path.relpath(PATH_IMAGE, PATH_VIEW)
+            with self.lock:
+                self.indexEntries.setdefault(PATH_VIEW, set()).add(entry)
+                self.staleEntries.get(PATH_VIEW, set()).discard(entry)
+            return
+
+        PATH_LINK = os.path.join(PATH_VIEW, fName)
+        try:
+            if os.path.lexists(PATH_LINK):
+                os.remove(PATH_LINK)
+            os.link(PATH_IMAGE, PATH_LINK)
+        except OSError:
+            # e.g. the file system has no hard links, so store a copy (still encoded once)
+            with open(PATH_LINK, "wb") as f:
+                f.write(data)
+
+    def _removeFromView(self, PATH_IMAGE, fName, PATH_VIEW):
+        """
+        Makes a written image disappear from a directory it no longer belongs to.
+
+        :param PATH_IMAGE: String, path to the written image.
+        :param fName: String, the file name of the image.
+        :param PATH_VIEW: String, path relative to the 'data' directory.
+        """
+        PATH_VIEW = os.path.join(self.PATH_DATA, PATH_VIEW)
+        if self.views == "index":
+            entry = os.path.relpath(PATH_IMAGE, PATH_VIEW)
+            with self.lock:
+                self.staleEntries.setdefault(PATH_VIEW, set()).add(entry)
+                self.indexEntries.get(PATH_VIEW, set()).discard(entry)
+            return
+
+        try:
+            os.remove(os.path.join(PATH_VIEW, fName))
+        except FileNotFoundError:
+            pass